@@ -1,13 +1,22 @@
 # app.py
+import sys
+
+import orjson
 from fastapi import FastAPI, Request, Header
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse
+from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Union
 from datetime import datetime
 
-app = FastAPI()
+# ORJSONResponse evita o caminho jsonable_encoder + json stdlib na resposta
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # ---------- MODELOS "INTERNOS" (normalizados) ----------
-class InternalMessageQuotedAudio(BaseModel):
+# Dataclasses com __slots__ em vez de BaseModel: os campos já chegam
+# extraídos/coercidos do JSON upstream, então validar de novo a cada evento
+# só custava CPU no caminho quente do webhook.
+@dataclass(frozen=True, slots=True)
+class InternalMessageQuotedAudio:
     url: str
     mimetype: str
     seconds: Optional[int] = None
@@ -19,15 +28,16 @@ class InternalMessageQuotedAudio(BaseModel):
     direct_path: Optional[str] = None
     waveform: Optional[str] = None
 
-class InternalMessage(BaseModel):
-    event: str = "messages.upsert"
+@dataclass(frozen=True, slots=True)
+class InternalMessage:
     instance: str
     remote_jid: str
     from_me: bool
     message_id: str
+    event: str = "messages.upsert"
     participant: Optional[str] = None
     push_name: Optional[str] = None
-    message_type: str
+    message_type: str = "unknown"
     text: Optional[str] = None
     timestamp: Optional[int] = None
     source: Optional[str] = None
@@ -36,60 +46,82 @@ class InternalMessage(BaseModel):
     quoted_type: Optional[str] = None
     quoted_audio: Optional[InternalMessageQuotedAudio] = None
 
-class InternalContactUpdate(BaseModel):
-    event: str = "contacts.update"
+@dataclass(frozen=True, slots=True)
+class InternalContactUpdate:
     instance: str
     remote_jid: str
+    event: str = "contacts.update"
     push_name: Optional[str] = None
     profile_pic_url: Optional[str] = None
 
-class InternalPresenceUpdate(BaseModel):
-    event: str = "presence.update"
+@dataclass(frozen=True, slots=True)
+class InternalPresenceUpdate:
     instance: str
     chat_id: str
     participant: str
     last_known_presence: str
+    event: str = "presence.update"
 
-class InternalChatUpdate(BaseModel):
+@dataclass(frozen=True, slots=True)
+class InternalChatUpdate:
+    # subset tipado do item upstream — guardar o dict inteiro em `raw`
+    # carregava o blob completo do chat por evento sem uso downstream
     event: str
     instance: str
     chat_id: Optional[str] = None
     name: Optional[str] = None
-    raw: Dict[str, Any] = Field(default_factory=dict)
+    unread_count: Optional[int] = None
+    archived: Optional[bool] = None
+    conversation_timestamp: Optional[int] = None
+
+InternalEvent = Union[InternalMessage, InternalContactUpdate, InternalPresenceUpdate, InternalChatUpdate]
 
 # ---------- HELPERS ----------
 def _ensure_list(x: Union[List[Any], Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # identidade de tipo no caminho comum (lista) — mais barato que o
+    # isinstance genérico, que percorre a MRO
+    if type(x) is list:
+        return x
     if x is None:
         return []
-    if isinstance(x, list):
-        return x
     return [x]
 
-def _safe_get(d: Dict[str, Any], path: str, default=None):
+# Caminhos pré-divididos em tuplas: evita str.split + lista nova a cada evento
+_PATH_REMOTE_JID = ("key", "remoteJid")
+_PATH_MESSAGE_ID = ("key", "id")
+_PATH_FROM_ME = ("key", "fromMe")
+_PATH_PARTICIPANT = ("key", "participant")
+
+def _safe_get(d: Dict[str, Any], path: tuple, default=None):
     cur = d
-    for p in path.split("."):
+    for p in path:
         if not isinstance(cur, dict) or p not in cur:
             return default
         cur = cur[p]
     return cur
 
+# g.us = grupo, s.whatsapp.net = contato normal, status@broadcast etc.
+_JID_SUFFIXES = {
+    "@g.us": "group",
+    "@s.whatsapp.net": "user",
+}
+
 def _jid_type(remote_jid: str) -> str:
-    # g.us = grupo, s.whatsapp.net = contato normal, status@broadcast etc.
-    if remote_jid.endswith("@g.us"):
-        return "group"
-    if remote_jid.endswith("@s.whatsapp.net"):
-        return "user"
-    return "other"
+    # um rfind + um dict get em vez de dois .endswith varrendo a string
+    at = remote_jid.rfind("@")
+    if at < 0:
+        return "other"
+    return _JID_SUFFIXES.get(remote_jid[at:], "other")
 
 # ---------- NORMALIZADORES POR EVENTO ----------
 def normalize_messages_upsert(body: Dict[str, Any]) -> List[InternalMessage]:
     out: List[InternalMessage] = []
     instance = body.get("instance")
     data = body.get("data", {})
-    remote_jid = _safe_get(data, "key.remoteJid")
-    message_id = _safe_get(data, "key.id")
-    from_me = bool(_safe_get(data, "key.fromMe", False))
-    participant = _safe_get(data, "key.participant")
+    remote_jid = _safe_get(data, _PATH_REMOTE_JID)
+    message_id = _safe_get(data, _PATH_MESSAGE_ID)
+    from_me = bool(_safe_get(data, _PATH_FROM_ME, False))
+    participant = _safe_get(data, _PATH_PARTICIPANT)
     push_name = data.get("pushName")
     status = data.get("status")
     message_type = data.get("messageType") or "unknown"
@@ -100,12 +132,12 @@ def normalize_messages_upsert(body: Dict[str, Any]) -> List[InternalMessage]:
     # texto simples (conversation)
     text = msg_obj.get("conversation")
 
-    # contexto/quoted
+    # contexto/quoted — short-circuit: a imensa maioria das mensagens não tem
+    # contextInfo, então sai cedo sem atravessar _safe_get/isinstance
     quoted_audio = None
     quoted_type = None
-    q = _safe_get(data, "contextInfo.quotedMessage")
-    if isinstance(q, dict) and "audioMessage" in q:
-        qa = q["audioMessage"]
+    ci = data.get("contextInfo")
+    if ci and (q := ci.get("quotedMessage")) and (qa := q.get("audioMessage")):
         quoted_type = "audioMessage"
         quoted_audio = InternalMessageQuotedAudio(
             url=qa.get("url"),
@@ -172,7 +204,9 @@ def normalize_chats_update(body: Dict[str, Any]) -> List[InternalChatUpdate]:
             event="chats.update",
             instance=instance,
             chat_id=item.get("remoteJid"),
-            raw=item
+            unread_count=item.get("unreadCount"),
+            archived=item.get("archived"),
+            conversation_timestamp=item.get("conversationTimestamp"),
         ))
     return out
 
@@ -185,7 +219,9 @@ def normalize_chats_upsert(body: Dict[str, Any]) -> List[InternalChatUpdate]:
             instance=instance,
             chat_id=item.get("id"),
             name=item.get("name"),
-            raw=item
+            unread_count=item.get("unreadCount"),
+            archived=item.get("archived"),
+            conversation_timestamp=item.get("conversationTimestamp"),
         ))
     return out
 
@@ -198,6 +234,15 @@ NORMALIZERS = {
     "chats.upsert": normalize_chats_upsert,
 }
 
+# Dispatch único aceitando as duas grafias ("messages.upsert" e
+# "messages-upsert", como chega no path_tail) — resolve o normalizador com
+# um só dict lookup, sem .replace() por request. Strings internadas para
+# hashing mais barato.
+EVENT_NORMALIZERS = {}
+for _evt, _fn in NORMALIZERS.items():
+    EVENT_NORMALIZERS[sys.intern(_evt)] = _fn
+    EVENT_NORMALIZERS[sys.intern(_evt.replace(".", "-"))] = _fn
+
 def normalized_event_name(body: Dict[str, Any], path_tail: Optional[str]) -> str:
     # preferir body["event"]; cair para path_tail se necessário
     evt = body.get("event")
@@ -208,7 +253,7 @@ def normalized_event_name(body: Dict[str, Any], path_tail: Optional[str]) -> str
         return path_tail.replace("-", ".")
     return "unknown"
 
-async def process_internal_events(events: List[BaseModel]):
+async def process_internal_events(events: List[InternalEvent]):
     """
     AQUI você integra com:
     - fila (e.g., RabbitMQ, Kafka)
@@ -230,15 +275,48 @@ async def process_internal_events(events: List[BaseModel]):
             # upsert chat
             pass
 
+# lote de eventos em um POST só: normaliza tudo e processa numa chamada
+# única (amortiza criação de objetos e, no futuro, um único round-trip/commit
+# de banco em process_internal_events)
+# OBS: registrado antes de /webhook/{path_tail} para não ser capturado por ele
+@app.post("/webhook/batch", response_model=None)
+async def webhook_batch(request: Request, apikey: Optional[str] = Header(None)):
+    payload = orjson.loads(await request.body())
+    bodies = payload.get("events") or []
+
+    all_events: List[InternalEvent] = []
+    ignored = 0
+    for body in bodies:
+        event = body.get("event") if isinstance(body, dict) else None
+        normalizer = EVENT_NORMALIZERS.get(event) if isinstance(event, str) else None
+        if not normalizer:
+            ignored += 1
+            continue
+        all_events.extend(normalizer(body))
+
+    await process_internal_events(all_events)
+
+    return {
+        "ok": True,
+        "received": len(bodies),
+        "emitted": len(all_events),
+        "ignored": ignored,
+        "ts": datetime.utcnow().isoformat() + "Z"
+    }
+
 # um único endpoint “flex” para /webhook/* (como você já usa)
-@app.post("/webhook/{path_tail}")
+@app.post("/webhook/{path_tail}", response_model=None)
 async def webhook_flex(path_tail: str, request: Request, apikey: Optional[str] = Header(None)):
-    body = await request.json()
+    # orjson direto nos bytes: evita o json stdlib do request.json()
+    body = orjson.loads(await request.body())
     # (opcional) validar apikey
     # if apikey != "seu-token-aqui": raise HTTPException(401, "unauthorized")
 
-    event = normalized_event_name(body, path_tail)
-    normalizer = NORMALIZERS.get(event)
+    # preferir body["event"]; cair para path_tail (forma com hífen já mapeada)
+    event = body.get("event")
+    if not isinstance(event, str):
+        event = path_tail or "unknown"
+    normalizer = EVENT_NORMALIZERS.get(event)
     if not normalizer:
         return {"ok": True, "ignored_event": event}
 
@@ -246,10 +324,14 @@ async def webhook_flex(path_tail: str, request: Request, apikey: Optional[str] =
     await process_internal_events(internal_events)
 
     # útil para auditoria/observabilidade
+    # (contagem inline — o normalizador já percorreu "data"; refazer
+    # _ensure_list aqui duplicava o trabalho)
+    data = body.get("data")
+    received = len(data) if type(data) is list else (0 if data is None else 1)
     return {
         "ok": True,
         "event": event,
-        "received": len(_ensure_list(body.get("data")) or [body.get("data")]),
+        "received": received,
         "emitted": len(internal_events),
         "ts": datetime.utcnow().isoformat() + "Z"
     }
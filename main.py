@@ -1,15 +1,38 @@
 # Ponto de entrada do app web (FastAPI)
-# Rode com:  E:\Python\Codigos\CooperVere> uvicorn codigos.coopervere.main:app --host 0.0.0.0 --port 8000 --reload
+# Dev:  E:\Python\Codigos\CooperVere> uvicorn codigos.coopervere.main:app --host 0.0.0.0 --port 8000 --reload
+# Prod: python -m codigos.coopervere.main  (workers via WEB_WORKERS; loop/http
+#       em "auto" usam uvloop+httptools quando instalados — no Windows caem
+#       no asyncio+h11 padrão)
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .webhooks.router import router as webhooks_router
 
 app = FastAPI(title="Coopervere - Evolution Webhook")
 
+
+class CORSMiddlewareExceptWebhooks(CORSMiddleware):
+    """CORS que ignora /webhook*.
+
+    Os webhooks do Evolution são server-to-server e nunca precisam de CORS;
+    pular o middleware evita cópia de headers e matching de origem em cada
+    POST do caminho mais quente do serviço.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/webhook"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
 # CORS básico para desenvolvimento local
+# (sem "*": com allow_credentials=True o wildcard era inválido e ainda
+# pagava matching por request)
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost", "http://127.0.0.1", "*"],
+    CORSMiddlewareExceptWebhooks,
+    allow_origins=["http://localhost", "http://127.0.0.1"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -18,10 +41,25 @@ app.add_middleware(
 # Rotas
 app.include_router(webhooks_router)
 
-@app.get("/")
+@app.get("/", response_model=None)
 def root():
     return {"ok": True, "service": "coopervere", "webhooks": ["/webhook", "/webhook/{event}"]}
 
-@app.get("/healthz")
+@app.get("/healthz", response_model=None)
 def health():
     return {"status": "healthy"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Serviço é I/O-bound (JSON entra, JSON pequeno sai): múltiplos workers
+    # + loop/http otimizados quando disponíveis rendem bem mais req/s.
+    uvicorn.run(
+        "codigos.coopervere.main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("WEB_PORT", "8000")),
+        workers=int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1))),
+        loop="auto",
+        http="auto",
+    )
@@ -20,6 +20,16 @@ from services.state_manager import (
 )
 
 
+# Configs do .env lidas e convertidas uma única vez no import — o loop
+# principal roda para sempre e não precisa reparsear as mesmas strings a
+# cada tick.
+PAY_REPORT_DAY_OF_WEEK = int(os.getenv("PAY_REPORT_DAY_OF_WEEK", "0"))  # padrão segunda
+PAY_REPORT_HOUR = int(os.getenv("PAY_REPORT_HOUR", "8"))                # padrão 08h
+PAY_REPORT_MINUTE = int(os.getenv("PAY_REPORT_MINUTE", "0"))            # padrão 00m
+BDAY_RUN_HOUR = int(os.getenv("BDAY_RUN_HOUR", "9"))                    # padrão 09h
+NOTIFY_INTERVAL_MINUTES = int(os.getenv("NOTIFY_INTERVAL_MINUTES", "30"))
+
+
 def should_run_weekly(hoje: date, agora: datetime, ultima_execucao: date) -> bool:
     """
     Regras:
@@ -28,13 +38,8 @@ def should_run_weekly(hoje: date, agora: datetime, ultima_execucao: date) -> boo
     - Executa SOMENTE se não rodou ainda no mesmo dia.
     """
 
-    # Lê configs do .env
-    dia_config = int(os.getenv("PAY_REPORT_DAY_OF_WEEK", "0"))  # padrão segunda
-    hora_config = int(os.getenv("PAY_REPORT_HOUR", "8"))        # padrão 08h
-    min_config  = int(os.getenv("PAY_REPORT_MINUTE", "0"))      # padrão 00m
-
     # Verifica o dia da semana
-    if hoje.weekday() != dia_config:
+    if hoje.weekday() != PAY_REPORT_DAY_OF_WEEK:
         return False
 
     # Evita executar mais de uma vez no dia
@@ -42,11 +47,27 @@ def should_run_weekly(hoje: date, agora: datetime, ultima_execucao: date) -> boo
         return False
 
     # Verifica horário mínimo
-    if agora.time() < dt_time(hora_config, min_config):
+    if agora.time() < dt_time(PAY_REPORT_HOUR, PAY_REPORT_MINUTE):
+        return False
+
+    return True
+
+def should_run_aniversarios(hoje: date, agora: datetime, ultima_execucao: date | None) -> bool:
+    """
+    Regras (mesmo espírito de should_run_weekly):
+    - Executa SOMENTE se horário atual >= hora configurada (BDAY_RUN_HOUR).
+    - Executa SOMENTE uma vez por dia — evita repetir a consulta de
+      aniversariantes a cada ciclo de 30 min o dia inteiro.
+    """
+    if ultima_execucao == hoje:
+        return False
+
+    if agora.time() < dt_time(BDAY_RUN_HOUR, 0):
         return False
 
     return True
 
+
 def should_run_festividade(agora: datetime) -> str | None:
     """Retorna 'natal' ou 'ano_novo' se estiver no dia e horário válidos."""
     if agora.month != 12:
@@ -65,12 +86,15 @@ def should_run_festividade(agora: datetime) -> str | None:
 
 def main():
 
-    interval_min = int(os.getenv("NOTIFY_INTERVAL_MINUTES", "30"))
-    interval_sec = max(60, interval_min * 60)
+    interval_sec = max(60, NOTIFY_INTERVAL_MINUTES * 60)
 
-    print(f"[Notifier] Iniciado. Intervalo: {interval_min} min")
+    print(f"[Notifier] Iniciado. Intervalo: {NOTIFY_INTERVAL_MINUTES} min")
 
     ultima_execucao_semana = load_ultima_execucao_semana()   # armazenamos apenas o dia
+    ultima_execucao_aniversarios: date | None = None
+
+    # Relógio monotônico para dormir até o próximo "tick" sem acumular drift
+    proximo_tick = time.monotonic()
 
     while True:
         agora = datetime.now()
@@ -98,8 +122,10 @@ def main():
         # 2.1) PROCESSA ANIVERSARIANTES DO DIA (EXECUÇÃO NORMAL)
         # --------------------------------------------------------
         try:
-            res_bday = processar_aniversariantes()
-            print(f"[Notifier {agora}] Aniversariantes => {res_bday}")
+            if should_run_aniversarios(hoje, agora, ultima_execucao_aniversarios):
+                res_bday = processar_aniversariantes()
+                ultima_execucao_aniversarios = hoje
+                print(f"[Notifier {agora}] Aniversariantes => {res_bday}")
         except Exception as e:
             print(f"[Notifier {agora}][ERRO Aniversariantes] {e}")
 
@@ -149,7 +175,15 @@ def main():
         # --------------------------------------------------------
         # 3) AGUARDA PRÓXIMO CICLO
         # --------------------------------------------------------
-        time.sleep(interval_sec)
+        # agenda o próximo tick em múltiplos exatos do intervalo, descontando
+        # o tempo gasto processando (sem drift acumulado)
+        proximo_tick += interval_sec
+        espera = proximo_tick - time.monotonic()
+        if espera <= 0:
+            # processamento demorou mais que o intervalo: realinha
+            proximo_tick = time.monotonic() + interval_sec
+            espera = interval_sec
+        time.sleep(espera)
 
 
 if __name__ == "__main__":
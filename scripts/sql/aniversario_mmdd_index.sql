@@ -0,0 +1,14 @@
+-- Coluna gerada + índice para a busca de aniversariantes.
+--
+-- O filtro antigo MONTH(cli_datanascimento) = :mes AND DAY(...) = :dia
+-- não aproveita índice nenhum e força full scan de `clientes` a cada ciclo
+-- do notifier. A coluna gerada abaixo materializa MMDD e permite index seek.
+--
+-- Executar uma única vez no banco (MySQL/MariaDB):
+
+ALTER TABLE clientes
+    ADD COLUMN cli_nasc_mmdd SMALLINT
+        GENERATED ALWAYS AS (MONTH(cli_datanascimento) * 100 + DAY(cli_datanascimento)) STORED;
+
+CREATE INDEX idx_clientes_nasc_mmdd
+    ON clientes (cli_nasc_mmdd, cli_status);
@@ -0,0 +1,13 @@
+-- Índices de apoio aos anti-joins da consulta de cobrança
+-- (services/cobranca_service.py, COBRANCA_SQL_BASE).
+--
+-- Os antigos NOT EXISTS viravam DEPENDENT SUBQUERY no MySQL; com os
+-- LEFT JOIN ... IS NULL estes índices permitem o anti-join por índice.
+-- Conferir o plano com: EXPLAIN <consulta>.
+-- Aplicar uma única vez no banco de produção.
+
+CREATE INDEX idx_log_envio_antijoin
+    ON log_envio_whatsapp (id_cobranca, categoria, status_envio, data_envio);
+
+CREATE INDEX idx_fmg_agrupado
+    ON financeiro_mov_groups (fmb_agrupado);
@@ -0,0 +1,14 @@
+-- Log de envios de festividades (Natal/Ano Novo) no banco.
+--
+-- Substitui o estado em JSON do services/state_manager.py para este
+-- fluxo: com a PK (cli_codigo, tipo, data) o anti-join da
+-- FESTIVIDADES_SQL devolve só os contatos ainda pendentes e o INSERT
+-- pós-envio é idempotente.
+-- Aplicar uma única vez no banco de produção.
+
+CREATE TABLE festividades_log (
+    cli_codigo  VARCHAR(20)  NOT NULL,
+    tipo        VARCHAR(10)  NOT NULL,   -- 'natal' | 'ano_novo'
+    data        DATE         NOT NULL,
+    PRIMARY KEY (cli_codigo, tipo, data)
+);
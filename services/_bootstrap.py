@@ -0,0 +1,10 @@
+# services/_bootstrap.py
+"""Carrega o .env uma única vez por processo.
+
+Cada serviço fazia o próprio load_dotenv() no import, reparseando o
+arquivo .env a cada módulo carregado. Importar este módulo garante um
+parse só; a leitura segue pelo os.getenv de sempre.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -1,12 +1,13 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from typing import Dict, List
+from typing import List, Mapping, Tuple
 
 from dotenv import load_dotenv
 from sqlalchemy import text
 
-from .database import create_db_engine
-from .evolution_api import EvolutionAPI
+from .database import get_db_engine
+from .evolution_api import EvolutionAPI, get_evolution_api
 from .notifier_service import normalizar_celular_br, notificar_ti_pedido_sem_celular
 from .state_manager import load_aniversarios_enviados, save_aniversarios_enviados
 
@@ -14,6 +15,13 @@ from .state_manager import load_aniversarios_enviados, save_aniversarios_enviado
 load_dotenv()
 
 
+# Limite de envios simultâneos ao Evolution API (cada um é um round-trip HTTP)
+ENVIO_MAX_WORKERS = int(os.getenv("ANIVERSARIO_MAX_WORKERS", "10"))
+
+
+# Usa a coluna gerada cli_nasc_mmdd (MONTH*100+DAY, indexada) em vez de
+# MONTH()/DAY() sobre cli_datanascimento, que forçava full scan da tabela.
+# DDL: scripts/sql/aniversario_mmdd_index.sql
 BIRTHDAY_SQL = text(
     """
  SELECT
@@ -24,42 +32,34 @@ BIRTHDAY_SQL = text(
     'N' AS ASSOCIADO
 FROM clientes P
 WHERE P.cli_status = 'Ativo'
-  AND P.cli_datanascimento IS NOT NULL
-  AND MONTH(P.cli_datanascimento) = :mes
-  AND DAY(P.cli_datanascimento) = :dia
+  AND P.cli_nasc_mmdd = :mmdd
     """
 )
 
 
-def _eh_associado(valor: str | None) -> bool:
-    return (valor or "").strip().upper() == "S"
+# Template único hoisted para o topo do módulo — os ramos associado/não
+# associado tinham texto idêntico, então o branch era código morto.
+_MSG_ANIVERSARIO = (
+    "🎉 Feliz aniversário, {nome}!\n"
+    "A Lima Limão deseja a você um dia iluminado e cheio de alegria. "
+    "Que não falte disposição para os seus treinos e leveza para os seus momentos de lazer. "
+    "Obrigada por fazer parte da nossa história e levar nosso estilo com você!"
+)
 
 
-def _montar_mensagem(nome: str, associado: bool) -> str:
+def _montar_mensagem(nome: str) -> str:
     primeiro_nome = (nome or "").split(" ")[0].strip() or "Cliente"
+    return _MSG_ANIVERSARIO.format(nome=primeiro_nome)
 
-    if associado:
-        return (
-        f"🎉 Feliz aniversário, {primeiro_nome}!\n"
-        "A Lima Limão deseja a você um dia iluminado e cheio de alegria. "
-        "Que não falte disposição para os seus treinos e leveza para os seus momentos de lazer. "
-        "Obrigada por fazer parte da nossa história e levar nosso estilo com você!"
-    )
-
-    return (
-        f"🎉 Feliz aniversário, {primeiro_nome}!\n"
-        "A Lima Limão deseja a você um dia iluminado e cheio de alegria. "
-        "Que não falte disposição para os seus treinos e leveza para os seus momentos de lazer. "
-        "Obrigada por fazer parte da nossa história e levar nosso estilo com você!"
-    )
 
-
-def buscar_aniversariantes(hoje: date) -> List[Dict]:
-    eng = create_db_engine()
+def buscar_aniversariantes(hoje: date) -> List[Mapping]:
+    eng = get_db_engine()
     with eng.connect() as conn:
-        rows = conn.execute(BIRTHDAY_SQL, {"mes": hoje.month, "dia": hoje.day}).mappings().all()
+        rows = conn.execute(BIRTHDAY_SQL, {"mmdd": hoje.month * 100 + hoje.day}).mappings().all()
 
-    return [dict(r) for r in rows]
+    # RowMapping já é um Mapping com .get(); copiar para dict era um
+    # dicionário extra por linha sem ganho algum.
+    return list(rows)
 
 
 def processar_aniversariantes(data_referencia: date | None = None) -> dict:
@@ -73,7 +73,7 @@ def processar_aniversariantes(data_referencia: date | None = None) -> dict:
 
     hoje = data_referencia or date.today()
     enviados_por_cliente = load_aniversarios_enviados()
-    evo = EvolutionAPI()
+    evo = get_evolution_api()
 
     stats = {
         "total": 0,
@@ -86,10 +86,31 @@ def processar_aniversariantes(data_referencia: date | None = None) -> dict:
     aniversariantes = buscar_aniversariantes(hoje)
     stats["total"] = len(aniversariantes)
 
+    try:
+        _enviar_felicitacoes(aniversariantes, hoje, enviados_por_cliente, evo, stats)
+    finally:
+        # flush único no fim (e em caso de falha, preserva o progresso parcial);
+        # gravar dentro do loop reescrevia o estado inteiro a cada envio.
+        save_aniversarios_enviados(enviados_por_cliente)
+
+    return stats
+
+
+def _enviar_felicitacoes(
+    aniversariantes: List[Mapping],
+    hoje: date,
+    enviados_por_cliente: dict,
+    evo: EvolutionAPI,
+    stats: dict,
+) -> None:
+    # 1ª fase (serial): filtra e monta as mensagens pendentes de envio
+    pendentes: List[Tuple[str, str, str]] = []  # (cliente_id, telefone, mensagem)
+
+    # BIRTHDAY_SQL define aliases fixos em maiúsculas, então os fallbacks
+    # minúsculos duplicavam cada lookup à toa.
     for linha in aniversariantes:
-        cliente_id = str(linha.get("CLIENTE") or linha.get("cliente") or "").strip()
-        nome = linha.get("NOME") or linha.get("nome") or "Cliente"
-        associado = _eh_associado(linha.get("associado") or linha.get("ASSOCIADO"))
+        cliente_id = str(linha.get("CLIENTE") or "").strip()
+        nome = linha.get("NOME") or "Cliente"
 
         if not cliente_id:
             continue
@@ -98,7 +119,7 @@ def processar_aniversariantes(data_referencia: date | None = None) -> dict:
             stats["ja_enviados"] += 1
             continue
 
-        telefone_raw = (linha.get("CELULAR") or linha.get("celular") or "").strip()
+        telefone_raw = (linha.get("CELULAR") or "").strip()
         #telefone_raw = '46999111465' # telefone teste
         telefone = normalizar_celular_br(telefone_raw)
 
@@ -112,15 +133,29 @@ def processar_aniversariantes(data_referencia: date | None = None) -> dict:
             )
             continue
 
-        mensagem = _montar_mensagem(nome, associado)
+        pendentes.append((cliente_id, telefone, _montar_mensagem(nome)))
+
+    if not pendentes:
+        return
 
+    # 2ª fase (paralela): os envios são HTTP independentes entre si,
+    # então o tempo total vira ~N/workers em vez de N round-trips seriais
+    def _enviar(item: Tuple[str, str, str]):
+        cliente_id, telefone, mensagem = item
         try:
             evo.send_text(telefone, mensagem)
+            return cliente_id, telefone, None
+        except Exception as e:
+            return cliente_id, telefone, e
+
+    with ThreadPoolExecutor(max_workers=ENVIO_MAX_WORKERS) as pool:
+        resultados = list(pool.map(_enviar, pendentes))
+
+    # 3ª fase (serial): consolida estado e estatísticas
+    for cliente_id, telefone, erro in resultados:
+        if erro is None:
             enviados_por_cliente[cliente_id] = hoje.isoformat()
-            save_aniversarios_enviados(enviados_por_cliente)
             stats["enviados"] += 1
-        except Exception as e:
+        else:
             stats["falhas"] += 1
-            print(f"[Aniversarios][ERRO] Falha ao enviar para {cliente_id} ({telefone}): {e}")
-
-    return stats
\ No newline at end of file
+            print(f"[Aniversarios][ERRO] Falha ao enviar para {cliente_id} ({telefone}): {erro}")
\ No newline at end of file
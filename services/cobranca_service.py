@@ -4,16 +4,18 @@ from __future__ import annotations
 import os
 import re
 import logging
+from collections import defaultdict
+from functools import lru_cache
 from dataclasses import dataclass
 from datetime import date, timedelta, datetime
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Dict, List, NamedTuple, Tuple, Optional
 
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from sqlalchemy.engine import Engine
 from .notifier_service import normalizar_celular_br
 
-from .database import create_db_engine
-from .evolution_api import EvolutionAPI, EvolutionAPIError
+from .database import get_db_engine
+from .evolution_api import EvolutionAPIError, get_evolution_api
 
 
 # -----------------------------------------------------------------------------
@@ -30,23 +32,34 @@ TI_DEDUP_CATEGORIA = "TI_TELEFONE_INVALIDO"
 # -----------------------------------------------------------------------------
 # Categorias vigentes
 # -----------------------------------------------------------------------------
-def gerar_categorias() -> List[Tuple[str, Any]]:
+class Categoria(NamedTuple):
+    nome: str
+    data_inicial: date
+    data_final: date
+
+
+def gerar_categorias() -> List[Categoria]:
+    # Datas já resolvidas aqui: o loop principal consumia tuplas ad-hoc
+    # (1, 2 ou 3 posições) e pagava isinstance/len por iteração.
     hoje = date.today()
     return [
-        ("vence_hoje", hoje),
+        Categoria("vence_hoje", hoje, hoje),
 
         # Exemplos (se quiser reativar depois):
-        # ("a_vencer_10_dias", hoje + timedelta(days=10)),
-        # ("a_vencer_5_dias", hoje + timedelta(days=5)),
-        # ("vencida_5_dias", hoje - timedelta(days=5)),
-        # ("vencida_10_dias", hoje - timedelta(days=10)),
-        # ("vencida_mais_30_dias", (hoje - timedelta(days=9999), hoje - timedelta(days=30))),
+        # Categoria("a_vencer_10_dias", hoje + timedelta(days=10), hoje + timedelta(days=10)),
+        # Categoria("a_vencer_5_dias", hoje + timedelta(days=5), hoje + timedelta(days=5)),
+        # Categoria("vencida_5_dias", hoje - timedelta(days=5), hoje - timedelta(days=5)),
+        # Categoria("vencida_10_dias", hoje - timedelta(days=10), hoje - timedelta(days=10)),
+        # Categoria("vencida_mais_30_dias", hoje - timedelta(days=9999), hoje - timedelta(days=30)),
     ]
 
 
 # -----------------------------------------------------------------------------
 # SQL base (a consulta que você definiu como correta)
 # -----------------------------------------------------------------------------
+# Anti-joins via LEFT JOIN ... IS NULL: o MySQL executava os NOT EXISTS
+# correlacionados como DEPENDENT SUBQUERY (uma sondagem por linha externa).
+# Índices de apoio: scripts/sql/cobranca_antijoin_indexes.sql
 COBRANCA_SQL_BASE = """
 SELECT
     fm.mfi_codigo,
@@ -59,6 +72,8 @@ SELECT
     c.cli_telefone AS telefone
 FROM financeiro_mov fm
 LEFT JOIN clientes c ON c.cli_codigo = fm.mfi_cliente
+LEFT JOIN financeiro_mov_groups g ON g.fmb_agrupado = fm.mfi_codigo
+{JOIN_LOG}
 WHERE
 (
   (fm.mfi_data_recebimento IS NULL AND fm.mfi_data_vencimento BETWEEN :DATA_INICIAL AND :DATA_FINAL)
@@ -68,11 +83,8 @@ WHERE
 AND fm.mfi_operacao = 'E'
 AND fm.mfi_status = 'P'
 AND (fm.mfi_proc IS NULL OR fm.mfi_proc NOT IN ('E','C'))
-AND NOT EXISTS (
-    SELECT 1
-    FROM financeiro_mov_groups g
-    WHERE g.fmb_agrupado = fm.mfi_codigo
-)
+AND g.fmb_agrupado IS NULL
+AND l.id_cobranca IS NULL
 {FILTRO_LOG}
 ORDER BY fm.mfi_data_vencimento
 """
@@ -81,7 +93,7 @@ ORDER BY fm.mfi_data_vencimento
 # -----------------------------------------------------------------------------
 # Model
 # -----------------------------------------------------------------------------
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CobrancaItem:
     mfi_codigo: str               # VARCHAR(12)
     cli_codigo: str               # geralmente VARCHAR (mantemos string)
@@ -95,99 +107,115 @@ class CobrancaItem:
 # -----------------------------------------------------------------------------
 # Utilitários
 # -----------------------------------------------------------------------------
+_HHMM_RE = re.compile(r"^(\d{2}):(\d{2})$")
+
+
 def _parse_hhmm(s: str) -> Tuple[int, int]:
-    m = re.match(r"^(\d{2}):(\d{2})$", s or "")
+    m = _HHMM_RE.match(s or "")
     if not m:
         return (9, 0)
     return int(m.group(1)), int(m.group(2))
 
 
+# Janela de envio parseada uma vez: os .env são constantes no processo,
+# não faz sentido rodar regex + replace de datetime a cada verificação.
+_H1, _M1 = _parse_hhmm(COBRANCA_HORARIO_INICIO)
+_H2, _M2 = _parse_hhmm(COBRANCA_HORARIO_FIM)
+
+
 def _is_within_business_hours(now: datetime) -> bool:
-    h1, m1 = _parse_hhmm(COBRANCA_HORARIO_INICIO)
-    h2, m2 = _parse_hhmm(COBRANCA_HORARIO_FIM)
-    start = now.replace(hour=h1, minute=m1, second=0, microsecond=0)
-    end = now.replace(hour=h2, minute=m2, second=59, microsecond=999999)
-    return start <= now <= end
+    return (_H1, _M1) <= (now.hour, now.minute) <= (_H2, _M2)
 
 
+@lru_cache(maxsize=4096)
 def _format_brl(value: Optional[float]) -> str:
+    # Memoizado: os mesmos valores arredondados se repetem entre duplicatas,
+    # e o split único substitui o triple-replace (3 varreduras da string).
     if not isinstance(value, (int, float)):
         return "—"
-    s = f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    return f"R$ {s}"
+    int_part, dec = f"{value:,.2f}".split(".")
+    return f"R$ {int_part.replace(',', '.')},{dec}"
 
 
 # -----------------------------------------------------------------------------
 # FILTRO_LOG e LOG de envios
 # -----------------------------------------------------------------------------
-def _build_filtro_log(categoria: str) -> str:
+def _build_join_log(categoria: str) -> str:
     """
-    Regra:
+    Regra (via anti-join, linha sem match no log fica com l.id_cobranca NULL):
     - Para as categorias normais: não reenviar se já existe OK para a mesma cobrança/categoria.
     - Para "vencida_mais_30_dias": não reenviar se OK nos últimos 5 dias.
     """
     if categoria == "vencida_mais_30_dias":
-        return """
-AND NOT EXISTS (
-    SELECT 1
-      FROM log_envio_whatsapp l
-     WHERE l.id_cobranca = fm.mfi_codigo
-       AND l.categoria = :CATEGORIA
-       AND l.status_envio = 'OK'
-       AND DATEDIFF(CURDATE(), l.data_envio) < 5
-)
+        return _JOIN_LOG_30DIAS
+    return _JOIN_LOG_DEFAULT
+
+
+_JOIN_LOG_DEFAULT = """
+LEFT JOIN log_envio_whatsapp l
+       ON l.id_cobranca = fm.mfi_codigo
+      AND l.categoria = :CATEGORIA
+      AND l.status_envio = 'OK'
 """
-    return """
-AND NOT EXISTS (
-    SELECT 1
-      FROM log_envio_whatsapp l
-     WHERE l.id_cobranca = fm.mfi_codigo
-       AND l.categoria = :CATEGORIA
-       AND l.status_envio = 'OK'
-)
+
+_JOIN_LOG_30DIAS = """
+LEFT JOIN log_envio_whatsapp l
+       ON l.id_cobranca = fm.mfi_codigo
+      AND l.categoria = :CATEGORIA
+      AND l.status_envio = 'OK'
+      AND DATEDIFF(CURDATE(), l.data_envio) < 5
 """
 
+# text() congelado por variante: montar a string e chamar text() a cada
+# consulta registrava a mesma query sob chaves diferentes no cache de
+# statements compilados do SQLAlchemy, anulando o cache.
+_SQL_DEFAULT = text(COBRANCA_SQL_BASE.format(JOIN_LOG=_JOIN_LOG_DEFAULT.strip(), FILTRO_LOG=""))
+_SQL_30DIAS = text(COBRANCA_SQL_BASE.format(JOIN_LOG=_JOIN_LOG_30DIAS.strip(), FILTRO_LOG=""))
 
-def registrar_envio(
-    eng: Engine,
-    *,
-    id_cobranca: str,
-    categoria: str,
-    status_envio: str,
-    mensagem_erro: Optional[str] = None,
-) -> None:
+
+REGISTRO_ENVIO_SQL = text("""
+    INSERT INTO log_envio_whatsapp (id_cobranca, categoria, status_envio, mensagem_erro, data_envio)
+    VALUES (:id_cobranca, :categoria, :status_envio, :mensagem_erro, NOW())
+""")
+
+
+def registrar_envios(eng: Engine, rows: List[Dict[str, Any]]) -> None:
     """
-    Grava um log de envio.
+    Grava logs de envio em lote (executemany, uma transação por lote).
+
+    Cada row: {"id_cobranca", "categoria", "status_envio", "mensagem_erro"}
     - status_envio: 'OK' ou 'ERRO'
     - mensagem_erro: texto livre quando ERRO (ou quando TI foi notificado)
+
+    Uma linha por INSERT custava um round-trip + commit por duplicata;
+    em lote vira um único commit por cliente/mensagem.
     """
-    sql = text("""
-        INSERT INTO log_envio_whatsapp (id_cobranca, categoria, status_envio, mensagem_erro, data_envio)
-        VALUES (:id_cobranca, :categoria, :status_envio, :mensagem_erro, NOW())
-    """)
+    if not rows:
+        return
     with eng.begin() as conn:
-        conn.execute(
-            sql,
-            {
-                "id_cobranca": id_cobranca,
-                "categoria": categoria,
-                "status_envio": status_envio,
-                "mensagem_erro": mensagem_erro,
-            },
-        )
+        conn.execute(REGISTRO_ENVIO_SQL, rows)
+
 
+TI_NOTIFICADOS_SQL = text("""
+    SELECT DISTINCT id_cobranca
+      FROM log_envio_whatsapp
+     WHERE categoria = :cat
+       AND status_envio = 'OK'
+       AND id_cobranca IN :ids
+""").bindparams(bindparam("ids", expanding=True))
 
-def ti_ja_notificado(eng: Engine, *, id_cobranca: str) -> bool:
-    sql = text("""
-        SELECT 1
-          FROM log_envio_whatsapp
-         WHERE id_cobranca = :id
-           AND categoria = :cat
-           AND status_envio = 'OK'
-         LIMIT 1
-    """)
+
+def ti_ja_notificados(eng: Engine, ids: List[str]) -> set:
+    """Retorna o subconjunto de `ids` que já tem aviso OK ao TI.
+
+    Uma consulta com IN expandido no lugar do SELECT 1 por duplicata
+    (padrão N+1 — um round-trip por cobrança do cliente).
+    """
+    if not ids:
+        return set()
     with eng.connect() as conn:
-        return conn.execute(sql, {"id": id_cobranca, "cat": TI_DEDUP_CATEGORIA}).first() is not None
+        rows = conn.execute(TI_NOTIFICADOS_SQL, {"cat": TI_DEDUP_CATEGORIA, "ids": ids})
+        return {r[0] for r in rows}
 
 
 # -----------------------------------------------------------------------------
@@ -205,35 +233,41 @@ def buscar_cobrancas_por_categoria(
     Retorna cobranças para a categoria/datas já aplicando o bloqueio via log (OK).
     - filtro_log_extra_sql: se quiser injetar mais restrições além do filtro padrão.
     """
-    filtro_log = _build_filtro_log(categoria)
-    filtro_log = (filtro_log + "\n" + (filtro_log_extra_sql or "")).strip()
-
-    sql = text(COBRANCA_SQL_BASE.format(FILTRO_LOG=("\n" + filtro_log if filtro_log else "")))
+    if filtro_log_extra_sql:
+        # Caminho raro: filtro extra ainda monta o SQL dinamicamente.
+        sql = text(COBRANCA_SQL_BASE.format(
+            JOIN_LOG=_build_join_log(categoria).strip(),
+            FILTRO_LOG="\n" + filtro_log_extra_sql.strip(),
+        ))
+    elif categoria == "vencida_mais_30_dias":
+        sql = _SQL_30DIAS
+    else:
+        sql = _SQL_DEFAULT
 
+    # Cursor server-side + desempacote posicional: .mappings().all()
+    # materializava tudo como RowMapping e ainda pagava lookup por chave
+    # em cada campo; aqui é uma passada só, direto para o dataclass.
     with eng.connect() as conn:
-        rows = conn.execute(
+        rows = conn.execution_options(stream_results=True, yield_per=500).execute(
             sql,
             {
                 "DATA_INICIAL": data_inicial,
                 "DATA_FINAL": data_final,
                 "CATEGORIA": categoria,
             },
-        ).mappings().all()
-
-    itens: List[CobrancaItem] = []
-    for r in rows:
-        itens.append(
+        )
+        return [
             CobrancaItem(
-                mfi_codigo=str(r["mfi_codigo"]),
-                cli_codigo=str(r["cli_codigo"]),
-                cli_nome=str(r["cli_nome"] or "").strip(),
-                telefone=(r.get("telefone") or None),
-                data_vencimento=r.get("mfi_data_vencimento"),
-                data_recebimento=r.get("mfi_data_recebimento"),
-                valor=r.get("mfi_valor"),
+                mfi_codigo=str(mfi_codigo),
+                cli_codigo=str(cli_codigo),
+                cli_nome=str(cli_nome or "").strip(),
+                telefone=(telefone or None),
+                data_vencimento=venc,
+                data_recebimento=receb,
+                valor=valor,
             )
-        )
-    return itens
+            for mfi_codigo, venc, receb, valor, _, cli_codigo, cli_nome, telefone in rows
+        ]
 
 
 # -----------------------------------------------------------------------------
@@ -264,14 +298,23 @@ def montar_mensagem_cliente(cli_nome: str, categoria: str, itens: List[CobrancaI
     )
 
 
-def montar_mensagem_ti(cli_codigo: str, cli_nome: str, telefone_raw: Optional[str], itens: List[CobrancaItem]) -> str:
-    ids = ", ".join(i.mfi_codigo for i in itens)
+def montar_mensagem_ti(pendencias: List[Tuple[str, str, Optional[str], List[CobrancaItem]]]) -> str:
+    """
+    Mensagem única ao TI com TODOS os clientes de telefone inválido da
+    execução (um disparo por rodada, não um por cliente).
+    """
+    blocos: List[str] = []
+    for cli_codigo, cli_nome, telefone_raw, itens in pendencias:
+        ids = ", ".join(i.mfi_codigo for i in itens)
+        blocos.append(
+            f"Cliente: {cli_nome} (cód. {cli_codigo})\n"
+            f"Telefone no cadastro: {telefone_raw or 'VAZIO'}\n"
+            f"Duplicatas pendentes (mfi_codigo): {ids}"
+        )
     return (
-        "⚠️ Telefone inválido para notificação de cobrança\n\n"
-        f"Cliente: {cli_nome} (cód. {cli_codigo})\n"
-        f"Telefone no cadastro: {telefone_raw or 'VAZIO'}\n"
-        f"Duplicatas pendentes (mfi_codigo): {ids}\n\n"
-        "Ajustar telefone no cadastro para liberar envio."
+        "⚠️ Telefones inválidos para notificação de cobrança\n\n"
+        + "\n\n".join(blocos)
+        + "\n\nAjustar telefone no cadastro para liberar envio."
     )
 
 
@@ -289,8 +332,14 @@ def processar_cobrancas() -> Dict[str, Any]:
     if not _is_within_business_hours(agora):
         return {"ok": True, "skipped": True, "reason": f"fora do horário ({agora:%H:%M})"}
 
-    eng = create_db_engine()
-    api = EvolutionAPI()
+    # Sem categoria ativa não há o que consultar: sai antes de tocar
+    # engine/Evolution (hoje só "vence_hoje", mas a lista é configurável).
+    categorias = gerar_categorias()
+    if not categorias:
+        return {"ok": True, "skipped": True, "reason": "nenhuma categoria ativa"}
+
+    eng = get_db_engine()
+    api = get_evolution_api()
 
     total_itens = 0
     total_ok = 0
@@ -299,35 +348,35 @@ def processar_cobrancas() -> Dict[str, Any]:
     total_erros_envio = 0
     total_ti_notificados = 0
 
-    for cat in gerar_categorias():
-        categoria = cat[0]
+    # Pendências de TI acumuladas na rodada inteira: 1 digest no final
+    # no lugar de um send_text serial por cliente com telefone inválido.
+    ti_pending: List[Tuple[str, str, Optional[str], List[CobrancaItem]]] = []
 
-        # resolução do range
-        if isinstance(cat[1], tuple):
-            data_inicial, data_final = cat[1]
-        elif len(cat) == 3:
-            data_inicial = cat[1]
-            data_final = cat[2]
-        else:
-            data_inicial = data_final = cat[1]
+    for cat in categorias:
+        categoria = cat.nome
 
         itens = buscar_cobrancas_por_categoria(
             eng,
-            data_inicial=data_inicial,
-            data_final=data_final,
+            data_inicial=cat.data_inicial,
+            data_final=cat.data_final,
             categoria=categoria,
         )
         total_itens += len(itens)
 
-        # Agrupa por cliente para enviar 1 mensagem por cliente/categoria
-        grupos: Dict[Tuple[str, str, Optional[str]], List[CobrancaItem]] = {}
+        # Agrupa por cliente para enviar 1 mensagem por cliente/categoria.
+        # Chave só pelo cli_codigo (único): hashear a tupla de 3 strings
+        # por duplicata aparecia no profile em lotes grandes.
+        grupos: Dict[str, List[CobrancaItem]] = defaultdict(list)
+        meta: Dict[str, Tuple[str, Optional[str]]] = {}
         for it in itens:
-            key = (it.cli_codigo, it.cli_nome, it.telefone)
-            grupos.setdefault(key, []).append(it)
+            if it.cli_codigo not in meta:
+                meta[it.cli_codigo] = (it.cli_nome, it.telefone)
+            grupos[it.cli_codigo].append(it)
 
         logging.info(f"[Cobrança] Categoria={categoria} => {len(itens)} itens | {len(grupos)} cliente(s)")
 
-        for (cli_codigo, cli_nome, telefone_raw), itens_cli in grupos.items():
+        for cli_codigo, itens_cli in grupos.items():
+            cli_nome, telefone_raw = meta[cli_codigo]
             total_clientes += 1
 
             #telefone_norm = normalizar_celular_br('46999111465')
@@ -339,22 +388,10 @@ def processar_cobrancas() -> Dict[str, Any]:
                 logging.warning(f"[Cobrança] Telefone inválido | cli={cli_codigo} {cli_nome} | raw={telefone_raw}")
 
                 if TI_WHATSAPP_NUMBER:
-                    pendentes_ti = [i for i in itens_cli if not ti_ja_notificado(eng, id_cobranca=i.mfi_codigo)]
+                    ja_avisados = ti_ja_notificados(eng, [i.mfi_codigo for i in itens_cli])
+                    pendentes_ti = [i for i in itens_cli if i.mfi_codigo not in ja_avisados]
                     if pendentes_ti:
-                        msg_ti = montar_mensagem_ti(cli_codigo, cli_nome, telefone_raw, pendentes_ti)
-                        try:
-                            api.send_text(TI_WHATSAPP_NUMBER, msg_ti)
-                            total_ti_notificados += 1
-                            for i in pendentes_ti:
-                                registrar_envio(
-                                    eng,
-                                    id_cobranca=i.mfi_codigo,
-                                    categoria=TI_DEDUP_CATEGORIA,
-                                    status_envio="OK",
-                                    mensagem_erro="Telefone inválido no cadastro (aviso ao TI)",
-                                )
-                        except Exception as e:
-                            logging.error(f"[Cobrança][TI] Falha ao notificar TI: {e}")
+                        ti_pending.append((cli_codigo, cli_nome, telefone_raw, pendentes_ti))
                 continue
 
             # Envia 1 mensagem por cliente/categoria
@@ -362,16 +399,20 @@ def processar_cobrancas() -> Dict[str, Any]:
             try:
                 api.send_text(telefone_norm, msg)
 
-                # Marca OK para cada duplicata da mensagem
-                for it in itens_cli:
-                    registrar_envio(
-                        eng,
-                        id_cobranca=it.mfi_codigo,
-                        categoria=categoria,
-                        status_envio="OK",
-                        mensagem_erro=None,
-                    )
-                    total_ok += 1
+                # Marca OK para cada duplicata da mensagem (um lote só)
+                registrar_envios(
+                    eng,
+                    [
+                        {
+                            "id_cobranca": it.mfi_codigo,
+                            "categoria": categoria,
+                            "status_envio": "OK",
+                            "mensagem_erro": None,
+                        }
+                        for it in itens_cli
+                    ],
+                )
+                total_ok += len(itens_cli)
 
                 logging.info(
                     f"[Cobrança] OK => {cli_nome} ({telefone_norm}) | categoria={categoria} | itens={len(itens_cli)}"
@@ -383,17 +424,43 @@ def processar_cobrancas() -> Dict[str, Any]:
                     f"[Cobrança] ERRO envio => {cli_nome} ({telefone_norm}) | categoria={categoria} | {e}"
                 )
                 # Opcional: registrar erro (mas NÃO bloqueia reenvio)
-                for it in itens_cli:
-                    try:
-                        registrar_envio(
-                            eng,
-                            id_cobranca=it.mfi_codigo,
-                            categoria=categoria,
-                            status_envio="ERRO",
-                            mensagem_erro=str(e),
-                        )
-                    except Exception:
-                        pass
+                try:
+                    registrar_envios(
+                        eng,
+                        [
+                            {
+                                "id_cobranca": it.mfi_codigo,
+                                "categoria": categoria,
+                                "status_envio": "ERRO",
+                                "mensagem_erro": str(e),
+                            }
+                            for it in itens_cli
+                        ],
+                    )
+                except Exception:
+                    pass
+
+    # Digest único ao TI + lote único de logs de dedup
+    if ti_pending:
+        msg_ti = montar_mensagem_ti(ti_pending)
+        try:
+            api.send_text(TI_WHATSAPP_NUMBER, msg_ti)
+            total_ti_notificados = len(ti_pending)
+            registrar_envios(
+                eng,
+                [
+                    {
+                        "id_cobranca": i.mfi_codigo,
+                        "categoria": TI_DEDUP_CATEGORIA,
+                        "status_envio": "OK",
+                        "mensagem_erro": "Telefone inválido no cadastro (aviso ao TI)",
+                    }
+                    for _, _, _, itens_ti in ti_pending
+                    for i in itens_ti
+                ],
+            )
+        except Exception as e:
+            logging.error(f"[Cobrança][TI] Falha ao notificar TI: {e}")
 
     return {
         "ok": True,
@@ -1,27 +1,61 @@
 # coopervere/services/danfe_service.py
 
+import gzip
+import logging
 import os
+import re
 import requests
-from typing import Dict, Any, List
-import base64
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, List, Optional, Tuple
 
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 
-from .database import create_db_engine
-from .evolution_api import EvolutionAPI, EvolutionAPIError
+from .database import get_db_engine
+from .evolution_api import EvolutionAPI, EvolutionAPIError, get_evolution_api
 from .notifier_service import normalizar_celular_br, notificar_ti_pedido_sem_celular
-from .gerar_danfe import gerar_danfe
+from .gerar_danfe import gerar_danfe_cached
 
 load_dotenv()
 
+# %-style adiado: o logging só formata se o nível estiver habilitado,
+# diferente das f-strings dos print() antigos (pagavam repr de payload
+# grande mesmo sem ninguém lendo).
+logger = logging.getLogger(__name__)
+
 
 MEUDANFE_URL = os.getenv("API_URL_MEU_DANFE_XML_TO_PDF")
+
+# Compressão do upload de XML (centenas de KB; gzip reduz 5-10x em XML).
+# Opt-in por .env enquanto não confirmamos o suporte do MeuDanfe; se o
+# servidor responder 415, o envio refaz sem compressão na mesma chamada.
+MEUDANFE_GZIP = os.getenv("MEUDANFE_GZIP", "0").strip().lower() in ("1", "true", "sim")
+
+# Sessão única com pool de conexões + retry: requests.post avulso pagava
+# handshake TCP+TLS novo a cada NF-e convertida.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    ),
+)
+# Prolog <?xml ...?> removido numa passada de regex só (os XML chegam
+# com centenas de KB; lstrip/startswith/slice faziam ~4 varreduras).
+_PROLOG_RE = re.compile(r"^\s*<\?xml[^?]*\?>\s*")
+
 STATUS_PENDENTE = "P"
 STATUS_ENVIADO = "E"
 STATUS_FALHA   = "F"
 
+# Limite de notas processadas em paralelo (cada uma faz DB + PDF + HTTP)
+DANFE_MAX_WORKERS = int(os.getenv("DANFE_MAX_WORKERS", "10"))
+
 
 class MeuDanfeError(RuntimeError):
     def __init__(self, message: str, status_code: int | None = None, payload: dict | None = None):
@@ -52,12 +86,23 @@ def converter_xml_para_danfe(xml: str) -> Dict[str, Any]:
         "Content-Type": "text/plain; charset=utf-8",
     }
 
-    resp = requests.post(
-        MEUDANFE_URL,
-        headers=headers,
-        data=xml.encode("utf-8"),
-        timeout=60,
-    )
+    body = xml.encode("utf-8")
+    if MEUDANFE_GZIP:
+        resp = _SESSION.post(
+            MEUDANFE_URL,
+            headers={**headers, "Content-Encoding": "gzip"},
+            data=gzip.compress(body),
+            timeout=60,
+        )
+        if resp.status_code != 415:
+            body = None  # enviado comprimido com sucesso (ou erro real)
+    if body is not None:
+        resp = _SESSION.post(
+            MEUDANFE_URL,
+            headers=headers,
+            data=body,
+            timeout=60,
+        )
 
     # Tratamento de erro de HTTP
     if resp.status_code != 200:
@@ -82,21 +127,44 @@ def converter_xml_para_danfe(xml: str) -> Dict[str, Any]:
 
     return data
 
+XML_NFE_SQL = text("""
+    SELECT XML, XMLAUTORIZACAO
+    FROM RETXMLNFE(:CHAVEACESSO)
+""")
+
+
 def buscar_xml_nfe(chave_acesso: str) -> str:
     """
     Busca o XML da NFe via RETXMLNFE(:CHAVEACESSO) e, se houver,
     combina XML + XMLAUTORIZACAO em um nfeProc completo.
     """
+    eng = get_db_engine()
+    with eng.connect() as conn:
+        row = conn.execute(XML_NFE_SQL, {"CHAVEACESSO": chave_acesso}).fetchone()
+    return _montar_xml_nfe(row, chave_acesso)
 
-    sql = text("""
-        SELECT XML, XMLAUTORIZACAO
-        FROM RETXMLNFE(:CHAVEACESSO)
-    """)
 
-    eng = create_db_engine()
+def buscar_xmls_nfe(chaves: List[str]) -> Dict[str, str]:
+    """
+    Busca o XML de várias chaves reutilizando UMA conexão do pool.
+
+    RETXMLNFE é função de tabela de chave única, então não dá para trocar
+    por um IN; mas uma conexão só para o lote elimina o checkout de pool
+    por nota. Chaves com erro ficam fora do dict (falham no processamento).
+    """
+    xmls: Dict[str, str] = {}
+    eng = get_db_engine()
     with eng.connect() as conn:
-        row = conn.execute(sql, {"CHAVEACESSO": chave_acesso}).fetchone()
+        for chave in chaves:
+            try:
+                row = conn.execute(XML_NFE_SQL, {"CHAVEACESSO": chave}).fetchone()
+                xmls[chave] = _montar_xml_nfe(row, chave)
+            except Exception as e:
+                logger.error("[DANFE] Falha ao buscar XML da chave %s: %s", chave, e)
+    return xmls
+
 
+def _montar_xml_nfe(row, chave_acesso: str) -> str:
     if not row:
         raise RuntimeError(f"NFe não encontrada para chave {chave_acesso}")
 
@@ -107,20 +175,13 @@ def buscar_xml_nfe(chave_acesso: str) -> str:
         raise RuntimeError(f"XML da NFe vazio para chave {chave_acesso}")
 
     # Se já veio um nfeProc completo, não mexe
-    if "<nfeProc" in xml_nfe:
+    # (busca limitada ao início: a tag raiz nunca passa dos primeiros bytes)
+    if xml_nfe.find("<nfeProc", 0, 200) != -1:
         return xml_nfe
 
     # Remove o prolog <?xml ...?> se vier em qualquer um
-    def strip_prolog(x: str) -> str:
-        x = x.lstrip()
-        if x.startswith("<?xml"):
-            fim = x.find("?>")
-            if fim != -1:
-                x = x[fim+2:].lstrip()
-        return x
-
-    xml_nfe = strip_prolog(xml_nfe)
-    xml_aut = strip_prolog(xml_aut)
+    xml_nfe = _PROLOG_RE.sub("", xml_nfe, count=1)
+    xml_aut = _PROLOG_RE.sub("", xml_aut, count=1)
 
     # Se não tiver XMLAUTORIZACAO, devolve só o XML da NFe mesmo
     if not xml_aut:
@@ -164,27 +225,45 @@ def buscar_notas_pendentes() -> List[dict]:
         WHERE STATUS = :STATUS_P
     """)
 
-    eng = create_db_engine()
+    eng = get_db_engine()
     with eng.connect() as conn:
         rows = conn.execute(sql, {"STATUS_P": STATUS_PENDENTE}).mappings().all()
 
     return [dict(r) for r in rows]
 
 
+ATUALIZA_STATUS_SQL = text("""
+    UPDATE CV_DANFE_VENDA_NOTIFICA
+       SET STATUS    = :STATUS,
+           DTHRENVIO = CURRENT_TIMESTAMP
+     WHERE CHAVEACESSO = :CHAVEACESSO
+""")
+
+
 def atualizar_status_nota(chave_acesso: str, status: str):
     """
     Atualiza STATUS e DTHRENVIO da CV_DANFE_VENDA_NOTIFICA.
     """
-    sql = text("""
-        UPDATE CV_DANFE_VENDA_NOTIFICA
-           SET STATUS    = :STATUS,
-               DTHRENVIO = CURRENT_TIMESTAMP
-         WHERE CHAVEACESSO = :CHAVEACESSO
-    """)
+    eng = get_db_engine()
+    with eng.begin() as conn:
+        conn.execute(ATUALIZA_STATUS_SQL, {"STATUS": status, "CHAVEACESSO": chave_acesso})
+
+
+def atualizar_status_notas(updates: List[Tuple[str, str]]) -> None:
+    """
+    Atualiza o STATUS de várias notas em lote (executemany, uma transação).
 
-    eng = create_db_engine()
+    updates: lista de (chave_acesso, status). Um UPDATE/commit por nota
+    custava um round-trip + fsync cada; o lote inteiro vira um commit só.
+    """
+    if not updates:
+        return
+    eng = get_db_engine()
     with eng.begin() as conn:
-        conn.execute(sql, {"STATUS": status, "CHAVEACESSO": chave_acesso})
+        conn.execute(
+            ATUALIZA_STATUS_SQL,
+            [{"STATUS": status, "CHAVEACESSO": chave} for chave, status in updates],
+        )
 
 def montar_msg_nfe(nota: dict) -> str:
     """
@@ -202,6 +281,124 @@ def montar_msg_nfe(nota: dict) -> str:
         f"CooperVerê informa o Faturamento da Nota Fiscal Nº {num_fmt}."
     )
 
+def _processar_nota(evo: EvolutionAPI, nota: dict, xml: Optional[str]) -> Tuple[bool, str]:
+    """
+    Processa UMA nota pendente (gera DANFE do XML pré-buscado e envia).
+    Retorna (enviada, status) — o status é gravado em lote pelo chamador,
+    em vez de um UPDATE/commit por nota dentro do pool.
+    """
+    chave = nota["chaveacesso"]
+    cel_raw = nota.get("cel_cliente") or "" # pega o telefone do cadastro do cliente.
+    # cel_raw = "5546999111465" # (telefone para teste)
+    nome_cli = nota.get("nome_cliente") or ""
+    serie = (nota.get("seriedoc") or "").strip()
+    numero = (nota.get("nrodoc") or "").strip()
+
+    try:
+        # ================================
+        # 1) Obter celular do cliente
+        # ================================
+        cel_norm = normalizar_celular_br(cel_raw)
+
+        if not cel_norm:
+            # sem celular válido: permanece pendente e avisa TI
+            try:
+                notificar_ti_pedido_sem_celular(
+                    contexto="NF-e",
+                    identificador=f"{serie}-{numero}",
+                    nome_cliente=nome_cli,
+                    celular_original=cel_raw,
+                )
+            except Exception as e_ti:
+                logger.warning("[DANFE] Falha ao avisar TI sobre NF %s-%s: %s", serie, numero, e_ti)
+
+            logger.warning("[DANFE] NF %s-%s: celular inválido %r", serie, numero, cel_raw)
+            return False, STATUS_PENDENTE
+
+        # ================================
+        # 2) XML pré-buscado em lote
+        # ================================
+        if xml is None:
+            logger.error("[DANFE] XML indisponível para NF chave %s", chave)
+            return False, STATUS_PENDENTE
+
+        # ================================
+        # 3) Gerar DANFE (PDF)
+        # ================================
+        try:
+            # ============================================================
+            # NOVO MÉTODO — GERAR PDF VIA LIB python `brazilfiscalreport`
+            # ============================================================
+
+            # cacheado por conteúdo: notas reprocessadas (retry de envio)
+            # não pagam o parse do XML + layout do PDF de novo
+            pdf_bytes = gerar_danfe_cached(xml)   # recebe bytes do PDF
+            pdf_name  = f"NFE-{chave}.pdf"
+
+        except Exception as e_geral_local:
+            logger.warning("[DANFE] Falha ao gerar DANFE localmente: %s", e_geral_local)
+
+            # ============================================================
+            # MÉTODO ANTIGO — API MeuDanfe (mantido como FAILOVER)
+            # ============================================================
+            # resp_md = converter_xml_para_danfe(xml)
+            # pdf_b64 = resp_md["data"]
+            # pdf_name = resp_md.get("name") or f"NFE-{chave}.pdf"
+
+            # Se quiser habilitar temporariamente o método antigo, DESCOMENTE acima ↓
+            raise RuntimeError("Falha ao gerar DANFE localmente e fallback desabilitado.")
+
+        # ================================
+        # 4) Montar mensagem de texto
+        # ================================
+        mensagem = montar_msg_nfe(nota)
+
+        # ================================
+        # 5) Enviar via Evolution API
+        # ================================
+        evo.send_media(
+            phone=cel_norm,
+            mediatype="document",
+            mimetype="application/pdf",
+            caption=mensagem,
+            media=pdf_bytes,  # send_media cuida do base64 numa passada só
+            file_name=pdf_name,
+        )
+
+        # ================================
+        # 6) Enviado (status gravado em lote pelo chamador)
+        # ================================
+        return True, STATUS_ENVIADO
+
+    except EvolutionAPIError as e:
+        # Erros vindos da Evolution (inclui HTTP 400 para número inválido)
+        logger.error(
+            "[DANFE] Evolution ao enviar NF chave %s: %s (status=%s, payload=%s)",
+            chave, e, getattr(e, "status_code", None), getattr(e, "payload", {}),
+        )
+
+        # Se for HTTP 400, muito provavelmente número de WhatsApp inválido → avisa TI
+        if getattr(e, "status_code", None) == 400:
+            try:
+                notificar_ti_pedido_sem_celular(
+                    contexto="NF-e",
+                    identificador=f"{serie}-{numero}",
+                    nome_cliente=nome_cli,
+                    celular_original=cel_norm or cel_raw,
+                )
+            except Exception as e_ti:
+                logger.warning(
+                    "[DANFE] Falha ao avisar TI sobre NF %s-%s (HTTP 400 Evolution): %s",
+                    serie, numero, e_ti,
+                )
+        return False, STATUS_PENDENTE
+
+    except (SQLAlchemyError, MeuDanfeError, Exception) as e:
+        # Demais erros de banco, MeuDanfe, etc.
+        logger.error("[DANFE] Falha ao enviar NF chave %s: %s", chave, e)
+        return False, STATUS_PENDENTE
+
+
 def processar_notas_pendentes() -> dict:
     """
     Processa todos registros em CV_DANFE_VENDA_NOTIFICA com STATUS='P':
@@ -211,8 +408,12 @@ def processar_notas_pendentes() -> dict:
       - Envia PDF via Evolution API (send_media)
       - Atualiza STATUS para 'E' ou 'F'
     Retorna um resumo com contagens.
+
+    Cada nota é independente (PDF + HTTP), então o lote roda em paralelo
+    num pool de threads limitado por DANFE_MAX_WORKERS. Os XML são
+    pré-buscados numa conexão só e os status gravados num commit só —
+    o fluxo antigo pagava 2N+1 round-trips de banco para N notas.
     """
-    evo = EvolutionAPI()
     pendentes = buscar_notas_pendentes()
 
     # print(pendentes) # validar o Json dos documentos pendentes.
@@ -220,127 +421,25 @@ def processar_notas_pendentes() -> dict:
     enviados = 0
     falhas = 0
 
-    for nota in pendentes:
-        chave = nota["chaveacesso"]
-        cel_raw = nota.get("cel_cliente") or "" # pega o telefone do cadastro do cliente.
-        # cel_raw = "5546999111465" # (telefone para teste)
-        nome_cli = nota.get("nome_cliente") or ""
-        serie = (nota.get("seriedoc") or "").strip()
-        numero = (nota.get("nrodoc") or "").strip()
+    if pendentes:
+        evo = get_evolution_api()
+        xmls = buscar_xmls_nfe([n["chaveacesso"] for n in pendentes])
 
-        try:
-            # ================================
-            # 1) Obter celular do cliente
-            # ================================
-            cel_norm = normalizar_celular_br(cel_raw)
-
-            if not cel_norm:
-                # sem celular válido: marca falha e avisa TI
-                atualizar_status_nota(chave, STATUS_PENDENTE)
-                falhas += 1
-
-                try:
-                    notificar_ti_pedido_sem_celular(
-                        contexto="NF-e",
-                        identificador=f"{serie}-{numero}",
-                        nome_cliente=nome_cli,
-                        celular_original=cel_raw,
-                    )
-                except Exception as e_ti:
-                    print(f"[WARN] Falha ao avisar TI sobre NF {serie}-{numero}: {e_ti}")
-
-                print(f"[WARN] NF {serie}-{numero}: celular inválido '{cel_raw}'")
-                continue
-
-           # ================================
-            # 2) Obter XML da nota
-            # ================================
-            xml = buscar_xml_nfe(chave)
-
-            # ================================
-            # 3) Gerar DANFE (PDF base64)
-            # ================================
-            try:
-                # ============================================================
-                # NOVO MÉTODO — GERAR PDF VIA LIB python `brazilfiscalreport`
-                # ============================================================
-
-                pdf_bytes = gerar_danfe(xml)                      # recebe bytes do PDF
-                pdf_b64   = base64.b64encode(pdf_bytes).decode()  # converte para base64
-                pdf_name  = f"NFE-{chave}.pdf"
-
-            except Exception as e_geral_local:
-                print(f"[WARN] Falha ao gerar DANFE localmente, tentando via MeuDanfe: {e_geral_local}")
-
-                # ============================================================
-                # MÉTODO ANTIGO — API MeuDanfe (mantido como FAILOVER)
-                # ============================================================
-                # resp_md = converter_xml_para_danfe(xml)
-                # pdf_b64 = resp_md["data"]
-                # pdf_name = resp_md.get("name") or f"NFE-{chave}.pdf"
-
-                # Se quiser habilitar temporariamente o método antigo, DESCOMENTE acima ↓
-                raise RuntimeError("Falha ao gerar DANFE localmente e fallback desabilitado.")
-
-            # ================================
-            # 4) Montar mensagem de texto
-            # ================================
-            mensagem = montar_msg_nfe(nota)
-
-            # ================================
-            # 5) Enviar via Evolution API
-            # ================================
-            evo.send_media(
-                phone=cel_norm,
-                mediatype="document",
-                mimetype="application/pdf",
-                caption=mensagem,
-                media=pdf_b64,
-                file_name=pdf_name,
-            )
-
-            # ================================
-            # 6) Marcar como enviado
-            # ================================
-            atualizar_status_nota(chave, STATUS_ENVIADO)
-            enviados += 1
-
-        except EvolutionAPIError as e:
-            # Erros vindos da Evolution (inclui HTTP 400 para número inválido)
-            falhas += 1
-            try:
-                atualizar_status_nota(chave, STATUS_PENDENTE)
-            except Exception:
-                pass
-
-            print(
-                f"[ERRO] Evolution ao enviar NF chave {chave}: {e} "
-                f"(status={getattr(e, 'status_code', None)}, payload={getattr(e, 'payload', {})})"
-            )
-
-            # Se for HTTP 400, muito provavelmente número de WhatsApp inválido → avisa TI
-            if getattr(e, "status_code", None) == 400:
-                try:
-                    notificar_ti_pedido_sem_celular(
-                        contexto="NF-e",
-                        identificador=f"{serie}-{numero}",
-                        nome_cliente=nome_cli,
-                        celular_original=cel_norm or cel_raw,
-                    )
-                except Exception as e_ti:
-                    print(f"[WARN] Falha ao avisar TI sobre NF {serie}-{numero} (HTTP 400 Evolution): {e_ti}")
-
-        except (SQLAlchemyError, MeuDanfeError, Exception) as e:
-            # Demais erros de banco, MeuDanfe, etc.
-            falhas += 1
-            try:
-                atualizar_status_nota(chave, STATUS_PENDENTE)
-            except Exception:
-                pass
-            print(f"[ERRO] Falha ao enviar NF chave {chave}: {e}")
+        with ThreadPoolExecutor(max_workers=DANFE_MAX_WORKERS) as pool:
+            resultados = list(pool.map(
+                lambda nota: _processar_nota(evo, nota, xmls.get(nota["chaveacesso"])),
+                pendentes,
+            ))
+
+        atualizar_status_notas([
+            (nota["chaveacesso"], status)
+            for nota, (_, status) in zip(pendentes, resultados)
+        ])
+        enviados = sum(ok for ok, _ in resultados)
+        falhas = len(resultados) - enviados
 
     return {
         "total": len(pendentes),
         "enviados": enviados,
         "falhas": falhas,
-    }
\ No newline at end of file
+    }
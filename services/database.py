@@ -1,5 +1,6 @@
 # services/database.py
 import os
+from functools import lru_cache
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 from dotenv import load_dotenv
@@ -29,9 +30,29 @@ def get_database_url() -> str:
 
 def create_db_engine() -> Engine:
     db_url = get_database_url()
-    engine = create_engine(db_url, pool_pre_ping=True, future=True)
+    # Pool explícito + cache de statements compilados: as mesmas ~4 consultas
+    # (cobrança, log de envio, RETXMLNFE...) rodam milhares de vezes por dia.
+    engine = create_engine(
+        db_url,
+        pool_pre_ping=True,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_recycle=1800,
+        query_cache_size=1200,
+        future=True,
+    )
     return engine
 
+@lru_cache(maxsize=1)
+def get_db_engine() -> Engine:
+    """Engine único do processo (reutiliza o pool de conexões).
+
+    create_db_engine() a cada chamada criava um pool novo e pagava o
+    handshake TCP completo por consulta; o Engine do SQLAlchemy foi feito
+    para ser singleton por processo.
+    """
+    return create_db_engine()
+
 def test_connection():
     engine = create_db_engine()
     with engine.connect() as conn:
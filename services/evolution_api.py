@@ -1,17 +1,27 @@
 # codigos/coopervere/services/evolution_api.py
 from __future__ import annotations
 
+import base64
 import os
 import re
-import json
-from typing import Any, Dict, Optional
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional, Union
 
+import orjson
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Teto de mensagens/segundo por processo (a Evolution corta em ~80 msg/s;
+# margem para não tomar 429 em rajadas dos pools de envio).
+EVO_MAX_RPS = float(os.getenv("EVO_MAX_RPS", "50"))
+
 
 class EvolutionAPIError(RuntimeError):
     """Erro de alto nível para respostas não-OK da Evolution API."""
@@ -21,15 +31,25 @@ class EvolutionAPIError(RuntimeError):
         self.payload = payload or {}
 
 
+# Compilado no import: re.sub com pattern literal refaz o lookup no cache
+# interno do re a cada chamada (uma por mensagem nos loops de envio).
+_NON_DIGITS_RE = re.compile(r"\D+")
+
+# Sufixos de JID conhecidos (contato e grupo): endswith compara só o
+# rabo da string, em vez do scan O(n) do operador `in`.
+_JID_SUFFIXES = ("@s.whatsapp.net", "@g.us")
+
+
 def _normalize_number(raw: str) -> str:
     """
     Normaliza números de telefone:
     - Mantém apenas dígitos (ex.: 5541999999999)
-    - Aceita formato JID (<número>@s.whatsapp.net)
+    - Aceita formato JID (<número>@s.whatsapp.net, <id>@g.us)
     """
-    if "@" in raw:
-        return raw.strip()
-    digits = re.sub(r"\D+", "", raw or "")
+    s = (raw or "").strip()
+    if s.endswith(_JID_SUFFIXES) or "@" in s:
+        return s
+    digits = _NON_DIGITS_RE.sub("", s)
     if not digits:
         raise ValueError("Número de destino inválido ou vazio.")
     return digits
@@ -61,6 +81,73 @@ class EvolutionAPI:
             "Content-Type": "application/json",
             "apikey": self.apikey,
         })
+        # Pool dimensionado para os ThreadPoolExecutors de envio + retry
+        # com backoff para 5xx transitórios (evita derrubar o lote inteiro
+        # por um 503 passageiro do Evolution). Métodos no default
+        # idempotente de propósito: num 502/504 o gateway pode já ter
+        # repassado a mensagem, e reenviar o POST duplicaria o WhatsApp.
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=50,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[502, 503, 504],
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Rate limit simples (intervalo mínimo entre envios), thread-safe:
+        # os envios saem de pools de threads, então a régua é compartilhada.
+        self._send_lock = threading.Lock()
+        self._min_interval = 1.0 / EVO_MAX_RPS if EVO_MAX_RPS > 0 else 0.0
+        self._next_send = 0.0
+
+        # Cache TTL do health(): (monotonic do probe, resultado)
+        self._last_health: tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+
+    def _throttle(self) -> None:
+        """Bloqueia o mínimo necessário para respeitar EVO_MAX_RPS."""
+        if not self._min_interval:
+            return
+        with self._send_lock:
+            now = time.monotonic()
+            espera = self._next_send - now
+            self._next_send = max(self._next_send, now) + self._min_interval
+        if espera > 0:
+            time.sleep(espera)
+
+    def _common_fields(
+        self,
+        delay: int,
+        link_preview: bool,
+        mentions_everyone: bool,
+        mentioned: Optional[list[str]],
+        quoted_id: Optional[str],
+        quoted_text: Optional[str],
+    ) -> Dict[str, Any]:
+        """Campos comuns de sendText/sendMedia.
+
+        Os opcionais só entram no payload quando realmente usados: o
+        "quoted" com strings vazias custava dicts extras por envio e
+        ~60 bytes a mais no wire em todo envio comum.
+        """
+        fields: Dict[str, Any] = {
+            "delay": delay,
+            "linkPreview": link_preview,
+            "mentionsEveryOne": mentions_everyone,
+        }
+        if mentioned:
+            fields["mentioned"] = mentioned
+        if quoted_id or quoted_text:
+            quoted: Dict[str, Any] = {}
+            if quoted_id:
+                quoted["key"] = {"id": quoted_id}
+            if quoted_text:
+                quoted["message"] = {"conversation": quoted_text}
+            fields["quoted"] = quoted
+        return fields
 
     # ==========================================================
     # Envio de mensagens
@@ -99,26 +186,18 @@ class EvolutionAPI:
         """
 
         number = _normalize_number(phone)
-        payload: Dict[str, Any] = {
-            "number": number,
-            "text": text,
-            "delay": delay,
-            "linkPreview": link_preview,
-            "mentionsEveryOne": mentions_everyone,
-        }
-
-        if mentioned:
-            payload["mentioned"] = mentioned
-
-        if quoted_id or quoted_text:
-            payload["quoted"] = {
-                "key": {"id": quoted_id or ""},
-                "message": {"conversation": quoted_text or ""},
-            }
+        payload: Dict[str, Any] = {"number": number, "text": text}
+        payload.update(self._common_fields(
+            delay, link_preview, mentions_everyone, mentioned, quoted_id, quoted_text,
+        ))
 
         url = f"{self.base_url}/message/sendText/{self.instance}"
 
-        resp = self.session.post(url, json=payload, timeout=self.timeout)
+        self._throttle()
+        # orjson serializa direto para bytes (o json= da requests passa
+        # pelo json.dumps + encode UTF-8 por mensagem); o Content-Type
+        # application/json já está nos headers da sessão.
+        resp = self.session.post(url, data=orjson.dumps(payload), timeout=self.timeout)
         return self._handle_response(resp)
     
     # ==========================================================
@@ -131,7 +210,7 @@ class EvolutionAPI:
         mediatype: str,
         mimetype: str,
         caption: str,
-        media: str,
+        media: Union[str, bytes, bytearray, memoryview],
         file_name: str,
         *,
         delay: int = 1000,
@@ -153,9 +232,15 @@ class EvolutionAPI:
                 media="<base64 ou URL>",
                 file_name="relatorio.pdf"
             )
+
+        `media` aceita também os bytes crus do arquivo: o base64 exigido
+        pelo sendMedia é gerado aqui (uma passada só, decode ascii), sem
+        o chamador precisar duplicar o buffer antes.
         """
 
         number = _normalize_number(phone)
+        if isinstance(media, (bytes, bytearray, memoryview)):
+            media = base64.b64encode(media).decode("ascii")
         payload: Dict[str, Any] = {
             "number": number,
             "mediatype": mediatype,
@@ -163,22 +248,14 @@ class EvolutionAPI:
             "caption": caption,
             "media": media,
             "fileName": file_name,
-            "delay": delay,
-            "linkPreview": link_preview,
-            "mentionsEveryOne": mentions_everyone,
         }
-
-        if mentioned:
-            payload["mentioned"] = mentioned
-
-        if quoted_id or quoted_text:
-            payload["quoted"] = {
-                "key": {"id": quoted_id or ""},
-                "message": {"conversation": quoted_text or ""},
-            }
+        payload.update(self._common_fields(
+            delay, link_preview, mentions_everyone, mentioned, quoted_id, quoted_text,
+        ))
 
         url = f"{self.base_url}/message/sendMedia/{self.instance}"
-        resp = self.session.post(url, json=payload, timeout=self.timeout)
+        self._throttle()
+        resp = self.session.post(url, data=orjson.dumps(payload), timeout=self.timeout)
         return self._handle_response(resp)
 
 
@@ -186,22 +263,35 @@ class EvolutionAPI:
     # ==========================================================
     # Verificação de status (opcional)
     # ==========================================================
-    def health(self) -> Dict[str, Any]:
-        """Verifica se o servidor Evolution está respondendo."""
+    def health(self, max_age_s: float = 30.0) -> Dict[str, Any]:
+        """Verifica se o servidor Evolution está respondendo.
+
+        O resultado fica cacheado por `max_age_s`: pré-checagens repetidas
+        antes de rajadas de envio não pagam um round-trip cada. Passe
+        max_age_s=0 para forçar um probe novo.
+        """
+        ts, cached = self._last_health
+        if cached is not None and time.monotonic() - ts < max_age_s:
+            return cached
         url = f"{self.base_url}/health"
         resp = self.session.get(url, timeout=self.timeout)
-        return self._handle_response(resp)
+        result = self._handle_response(resp)
+        self._last_health = (time.monotonic(), result)
+        return result
 
     # ==========================================================
     # Tratamento de resposta
     # ==========================================================
     def _handle_response(self, resp: Response) -> Dict[str, Any]:
+        # orjson.loads parseia direto dos bytes; resp.json() decodifica
+        # para str intermediária antes de parsear.
+        content = resp.content
         try:
             resp.raise_for_status()
         except requests.HTTPError as http_err:
             try:
-                payload = resp.json()
-            except Exception:
+                payload = orjson.loads(content)
+            except orjson.JSONDecodeError:
                 payload = {"text": resp.text}
             raise EvolutionAPIError(
                 f"Evolution API HTTP {resp.status_code}",
@@ -210,11 +300,21 @@ class EvolutionAPI:
             ) from http_err
 
         try:
-            return resp.json()
-        except ValueError:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
             return {"raw": resp.text}
 
 
+@lru_cache(maxsize=1)
+def get_evolution_api() -> EvolutionAPI:
+    """Instância única do processo (reaproveita Session/pool e o rate limit).
+
+    Criar EvolutionAPI() a cada rodada descartava o pool de conexões e
+    deixava cada serviço com sua própria régua de envio.
+    """
+    return EvolutionAPI()
+
+
 # ==========================================================
 # Execução direta para teste rápido
 # ==========================================================
@@ -1,63 +1,128 @@
+import logging
+import os
 import time
+from dataclasses import asdict, dataclass
 from datetime import date
-from typing import Dict, List, Literal
+from typing import Dict, Iterator, List, Literal
 
 from dotenv import load_dotenv
 from sqlalchemy import text
 
-from .database import create_db_engine
-from .evolution_api import EvolutionAPI
+from .database import get_db_engine
+from .evolution_api import get_evolution_api
 from .notifier_service import normalizar_celular_br
-from .state_manager import load_festividades_enviados, save_festividades_enviados
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
+# Orçamento anti-spam entre envios (segundos). O pacing é por agenda
+# monotônica: a latência do POST conta dentro do intervalo, em vez de
+# somar um sleep cheio de 10s por mensagem à espera da resposta.
+FESTIVIDADES_INTERVALO_S = float(os.getenv("FESTIVIDADES_INTERVALO_S", "10"))
+
+
+# Dedup no próprio SELECT (anti-join com festividades_log, ver
+# scripts/sql/festividades_log.sql): quem já recebeu hoje nem sai do
+# banco, em vez de carregar o estado JSON inteiro e filtrar em Python.
 FESTIVIDADES_SQL = text(
     """
  SELECT
-    cli_codigo AS CLIENTE,
-    cli_nome AS NOME,
-    cli_telefone AS CELULAR
- FROM clientes
- WHERE clientes.cli_status = 'Ativo'
- AND clientes.cli_telefone IS NOT NULL 
- AND clientes.cli_telefone != ''
+    c.cli_codigo AS CLIENTE,
+    c.cli_nome AS NOME,
+    c.cli_telefone AS CELULAR
+ FROM clientes c
+ LEFT JOIN festividades_log l
+    ON l.cli_codigo = c.cli_codigo
+   AND l.tipo = :tipo
+   AND l.data = :hoje
+ WHERE c.cli_status = 'Ativo'
+ AND c.cli_telefone IS NOT NULL
+ AND c.cli_telefone != ''
+ AND l.cli_codigo IS NULL
+    """
+)
+
+# INSERT IGNORE: reexecuções no mesmo dia não estouram a PK
+# (cli_codigo, tipo, data) se um envio for registrado duas vezes.
+FESTIVIDADES_LOG_INSERT_SQL = text(
+    """
+ INSERT IGNORE INTO festividades_log (cli_codigo, tipo, data)
+ VALUES (:cli_codigo, :tipo, :data)
     """
 )
 
 
+@dataclass(slots=True)
+class SendStats:
+    """Contadores da rodada (atributos com slots: sem hash de chave de
+    dict a cada incremento no loop de milhares de contatos)."""
+    total: int = 0
+    enviados: int = 0
+    sem_celular: int = 0
+    falhas: int = 0
+
+
 def _primeiro_nome(nome: str | None) -> str:
     return (nome or "").split(" ")[0].strip() or "Cliente"
 
 
-def _montar_mensagem_festividade(tipo: Literal["natal", "ano_novo"], nome: str, ano_base: int) -> str:
-    primeiro_nome = _primeiro_nome(nome)
+# Templates em constantes de módulo: a prosa fixa era remontada por
+# f-string a cada contato. Os anos são resolvidos uma vez por rodada
+# (_montar_template_festividade); só {nome} varia por mensagem.
+_TPL_NATAL = (
+    "🎄 Olá, {nome}!\n\n"
+    "A Lima Limão agradece por você fazer parte da nossa história este ano. "
+    "Que o seu Natal seja repleto de brilho, conforto e momentos especiais ao lado de quem você ama. "
+    "Esperamos que você celebre com muito estilo e energia. Boas festas!"
+)
 
-    if tipo == "natal":
-        return (
-            f"🎄 Olá, {primeiro_nome}!\n\n"
-            "A Lima Limão agradece por você fazer parte da nossa história este ano. "
-            "Que o seu Natal seja repleto de brilho, conforto e momentos especiais ao lado de quem você ama. "
-            "Esperamos que você celebre com muito estilo e energia. Boas festas!"
-        )
+_TPL_ANO_NOVO = (
+    "✨ Olá, {nome}!\n\n"
+    "A Lima Limão deseja que o seu Ano Novo chegue com muita cor, leveza e movimento. "
+    "Obrigado por nos escolher para acompanhar seus treinos e seus momentos de lazer em {ano_base}. "
+    "Que em {proximo_ano} possamos alcançar novas metas e conquistas juntos. Feliz Ano Novo!"
+)
 
-    proximo_ano = ano_base + 1
-    return (
-        f"✨ Olá, {primeiro_nome}!\n\n"
-        "A Lima Limão deseja que o seu Ano Novo chegue com muita cor, leveza e movimento. "
-        f"Obrigado por nos escolher para acompanhar seus treinos e seus momentos de lazer em {ano_base}. "
-        f"Que em {proximo_ano} possamos alcançar novas metas e conquistas juntos. Feliz Ano Novo!"
+_TEMPLATES = {"natal": _TPL_NATAL, "ano_novo": _TPL_ANO_NOVO}
+
+
+def _montar_template_festividade(tipo: Literal["natal", "ano_novo"], ano_base: int) -> str:
+    """Resolve os anos do template, deixando só {nome} para o loop."""
+    return _TEMPLATES[tipo].format_map(
+        {"nome": "{nome}", "ano_base": ano_base, "proximo_ano": ano_base + 1}
     )
 
 
-def buscar_contatos_festividade() -> List[Dict]:
-    eng = create_db_engine()
-    with eng.connect() as conn:
-        rows = conn.execute(FESTIVIDADES_SQL).mappings().all()
+def buscar_contatos_festividade(
+    tipo: Literal["natal", "ano_novo"], hoje: date
+) -> Iterator[Dict]:
+    """Itera os contatos ainda pendentes via cursor server-side.
 
-    return [dict(r) for r in rows]
+    O .mappings().all() antigo materializava a carteira inteira e ainda
+    reconstruía cada linha como dict numa segunda passada; o dedup do
+    dia já vem resolvido pelo anti-join da FESTIVIDADES_SQL.
+    """
+    eng = get_db_engine()
+    with eng.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=500).execute(
+            FESTIVIDADES_SQL, {"tipo": tipo, "hoje": hoje}
+        )
+        for row in result.mappings():
+            yield dict(row)
+
+
+def _registrar_festividade_enviada(
+    cliente_id: str, tipo: Literal["natal", "ano_novo"], hoje: date
+) -> None:
+    """Grava o envio no log do banco (idempotente via PK)."""
+    eng = get_db_engine()
+    with eng.begin() as conn:
+        conn.execute(
+            FESTIVIDADES_LOG_INSERT_SQL,
+            {"cli_codigo": cliente_id, "tipo": tipo, "data": hoje},
+        )
 
 
 def processar_festividades(
@@ -80,59 +145,60 @@ def processar_festividades(
     if tipo == "ano_novo" and (hoje.month != 12 or hoje.day != 31):
         return {"erro": "Fora da data de Ano Novo"}
 
-    enviados_por_cliente = load_festividades_enviados()
-    evo = EvolutionAPI()
+    evo = get_evolution_api()
+
+    stats = SendStats()
 
-    stats = {
-        "total": 0,
-        "enviados": 0,
-        "ja_enviados": 0,
-        "sem_celular": 0,
-        "falhas": 0,
-    }
+    # O anti-join já exclui quem consta em festividades_log para
+    # (tipo, hoje); o loop abaixo só cuida de telefone e mensagem.
+    contatos = buscar_contatos_festividade(tipo, hoje)
 
-    contatos = buscar_contatos_festividade()
-    stats["total"] = len(contatos)
+    template = _montar_template_festividade(tipo, hoje.year)
 
+    # Fase 1 (só CPU): resolve telefone/mensagem numa passada e deixa
+    # para o loop lento de envio apenas os contatos acionáveis.
+    acionaveis: List[tuple] = []
+    # Subscrito direto: o SQL garante os aliases CLIENTE/NOME/CELULAR,
+    # então o fallback minúsculo era um segundo lookup morto por campo.
     for linha in contatos:
-        cliente_id = str(linha.get("CLIENTE") or linha.get("cliente") or "").strip()
-        nome = linha.get("NOME") or linha.get("nome") or "Cliente"
+        stats.total += 1
+        cliente_id = str(linha["CLIENTE"] or "").strip()
+        nome = linha["NOME"] or "Cliente"
 
         if not cliente_id:
             continue
 
-        registro_cliente = enviados_por_cliente.get(cliente_id, {})
-        if isinstance(registro_cliente, dict):
-            if registro_cliente.get(tipo) == hoje.isoformat():
-                stats["ja_enviados"] += 1
-                continue
-        else:
-            registro_cliente = {}
-
-        telefone_raw = (linha.get("CELULAR") or linha.get("celular") or "").strip()
+        telefone_raw = (linha["CELULAR"] or "").strip()
         #telefone_raw = '46999111465'
         telefone = normalizar_celular_br(telefone_raw)
 
         if not telefone:
-            stats["sem_celular"] += 1
+            stats.sem_celular += 1
             continue
 
-        mensagem = _montar_mensagem_festividade(tipo, nome, hoje.year)
-        envio_tentado = False
+        mensagem = template.format_map({"nome": _primeiro_nome(nome)})
+        acionaveis.append((cliente_id, telefone, mensagem))
+
+    proximo_envio = time.monotonic()
+
+    # Fase 2 (só I/O): envia com pacing anti-spam. Cada envio grava sua
+    # linha em festividades_log na hora: se a rodada cair no meio, a
+    # próxima execução retoma só os pendentes.
+    for cliente_id, telefone, mensagem in acionaveis:
+        # espera só o que falta do orçamento anti-spam desta rodada
+        espera = proximo_envio - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        proximo_envio = time.monotonic() + FESTIVIDADES_INTERVALO_S
 
         try:
             evo.send_text(telefone, mensagem)
-            registro_cliente[tipo] = hoje.isoformat()
-            enviados_por_cliente[cliente_id] = registro_cliente
-            save_festividades_enviados(enviados_por_cliente)
-            stats["enviados"] += 1
-            envio_tentado = True
-        except Exception as e:
-            stats["falhas"] += 1
-            print(f"[Festividades][ERRO] Falha ao enviar para {cliente_id} ({telefone}): {e}")
-            envio_tentado = True
-        finally:
-            if envio_tentado:
-                time.sleep(10)
-
-    return stats
\ No newline at end of file
+            _registrar_festividade_enviada(cliente_id, tipo, hoje)
+            stats.enviados += 1
+        except Exception:
+            stats.falhas += 1
+            logger.exception(
+                "[Festividades] Falha ao enviar para cliente=%s tel=%s", cliente_id, telefone
+            )
+
+    return asdict(stats)
\ No newline at end of file
@@ -1,6 +1,11 @@
 # pip install brazilfiscalreport
 
-from typing import Optional
+import copy
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional
 from io import BytesIO
 from brazilfiscalreport.danfe import (
     Danfe,
@@ -13,17 +18,21 @@ from brazilfiscalreport.danfe import (
     TaxConfiguration,
 )
 
+# 🖼 LOGO (opcional) — caminho lido uma vez do ambiente
+LOGO_PATH = os.getenv("DANFE_LOGO_PATH", "C:/BotCop/coopervere/services/LogoLima.png")
 
-def gerar_danfe(xml) -> None:
-    """
-    Gera um arquivo PDF de DANFE a partir do conteúdo XML em texto.
 
-    :param xml:   Conteúdo XML da NF-e em formato de string (não precisa ser arquivo).
-    :param logo:  Caminho para o arquivo de logo (PNG/JPG). Se None, gera sem logo.
-    :param output: Caminho completo do arquivo PDF de saída (ex.: 'saida/danfe.pdf').
-    """
+@lru_cache(maxsize=1)
+def _logo_bytes() -> bytes:
+    """Bytes do logo lidos UMA vez: passar o caminho fazia a lib reabrir
+    e decodificar o PNG do disco a cada nota."""
+    with open(LOGO_PATH, "rb") as f:
+        return f.read()
 
-    # Cria o objeto de configuração do DANFE com alguns padrões “sensatos”.
+
+@lru_cache(maxsize=1)
+def _danfe_config() -> DanfeConfig:
+    """Config base do DANFE montada uma vez (valores são constantes)."""
     config = DanfeConfig(
         # 📄 MARGENS DO PDF (em milímetros)
         # Ajuste se precisar de mais/menos espaço em impressoras específicas.
@@ -66,11 +75,6 @@ def gerar_danfe(xml) -> None:
         font_type=FontType.TIMES,
     )
 
-    # 🖼 LOGO (opcional)
-    # Se o caminho do logo foi informado, atribui na configuração.
-    # A lib aceita também bytes/BytesIO, mas aqui usamos apenas o caminho.
-    config.logo = 'C:/BotCop/coopervere/services/LogoLima.png'  
-
     # 💰 EXIBIR PIS/COFINS NOS TOTAIS
     # True  -> mostra PIS e COFINS
     # False -> não mostra
@@ -94,6 +98,24 @@ def gerar_danfe(xml) -> None:
     #         e também trata casos sem protNFe.
     config.watermark_cancelled = False
 
+    return config
+
+
+def gerar_danfe(xml) -> memoryview:
+    """
+    Gera um arquivo PDF de DANFE a partir do conteúdo XML em texto.
+
+    :param xml:   Conteúdo XML da NF-e em formato de string (não precisa ser arquivo).
+    """
+
+    # Cópia rasa da config cachada: o logo é um BytesIO consumível e o
+    # gerador roda em pool de threads, então cada chamada recebe a sua
+    # própria view sobre os bytes já carregados (sem reler o PNG).
+    config = copy.copy(_danfe_config())
+    logo = BytesIO(_logo_bytes())
+    logo.name = "LogoLima.png"
+    config.logo = logo
+
     # Cria o objeto DANFE a partir do XML em string + configuração definida acima
      # Instancia o gerador de DANFE
     danfe = Danfe(xml=xml, config=config)
@@ -107,7 +129,47 @@ def gerar_danfe(xml) -> None:
     # Gera o PDF dentro do buffer
     danfe.output(buffer)
 
-    # Retorna os bytes do PDF
-    return buffer.getvalue()
+    # Retorna os bytes do PDF sem copiar: getvalue() duplicava o buffer
+    # inteiro (~centenas de KB por nota); a memoryview referencia o
+    # conteúdo do BytesIO direto e o b64encode do envio aceita buffer.
+    return buffer.getbuffer()
+
+
+@lru_cache(maxsize=128)
+def _render_pdf_cached(xml_hash: str, xml: str) -> bytes:
+    # O hash entra na chave para a comparação de cache ficar barata em
+    # reexecuções (o == de strings de XML grandes só roda em colisão).
+    return bytes(gerar_danfe(xml))
 
 
+def gerar_danfe_cached(xml: str) -> bytes:
+    """gerar_danfe com memoização por conteúdo do XML.
+
+    A Danfe reparseia o XML e remonta o layout inteiro a cada chamada;
+    quando a mesma NF-e volta à fila (retry de envio, nota que ficou
+    pendente entre rodadas), o PDF já renderizado sai do cache. A chave
+    é o blake2b do conteúdo, então XMLs idênticos colidem de propósito.
+    """
+    chave = hashlib.blake2b(xml.encode(), digest_size=16).hexdigest()
+    return _render_pdf_cached(chave, xml)
+
+
+def _render_bytes(xml) -> bytes:
+    # bytes picklável para atravessar a fronteira do processo worker
+    # (memoryview não serializa).
+    return bytes(gerar_danfe(xml))
+
+
+def gerar_danfe_batch(xmls: List[str]) -> List[bytes]:
+    """
+    Renderiza vários DANFEs em paralelo, um processo por núcleo.
+
+    A renderização é CPU-pura (parsing do XML + layout do PDF) e presa ao
+    GIL, então threads não ajudam; em lote (ex.: fechamento do dia) o
+    ganho escala com o número de núcleos. Config e logo cacheados são
+    recriados por processo no primeiro uso (lru_cache é por worker).
+    """
+    if not xmls:
+        return []
+    with ProcessPoolExecutor() as ex:
+        return list(ex.map(_render_bytes, xmls))
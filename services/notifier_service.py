@@ -1,45 +1,101 @@
 # codigos/coopervere/services/notifier_service.py
+import hashlib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Tuple
+from functools import lru_cache
+from itertools import groupby
+from typing import Optional, Tuple
 import re
 
-from dotenv import load_dotenv
-from sqlalchemy import text
+import orjson
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import SQLAlchemyError
 
-from .database import create_db_engine
-from .evolution_api import EvolutionAPI
+from .database import get_db_engine
+from .evolution_api import get_evolution_api
 
-from .pdf_utils import build_pedido_pdf 
+from .pdf_utils import build_pedido_pdf, fmt_moeda
 
 
-load_dotenv()
+from . import _bootstrap  # noqa: F401  (parse único do .env)
 
 STATUS_PENDENTE = "P"
 STATUS_ENVIADO = "E"
 STATUS_FALHA = "F"
 
+# Compilado no import: evita o lookup no cache interno do re a cada
+# telefone normalizado (um por contato nos lotes grandes).
+_NON_DIGIT_RE = re.compile(r"\D")
+
+# Celular do TI lido uma vez no import (a normalização fica por conta
+# do lru_cache do normalizar_celular_br na primeira chamada).
+_TI_NOTIFY_PHONE_RAW = os.getenv("TI_NOTIFY_PHONE", "").strip()
+
+# Envios em paralelo: o gargalo é o round-trip HTTP da Evolution, então
+# o tempo de parede do lote cai de soma(RTT) para ~max(RTT).
+ENVIO_MAX_WORKERS = int(os.getenv("PEDIDO_MAX_WORKERS", "8"))
+
+# Cache de PDFs por conteúdo do pedido: quando o celular está errado o
+# pedido volta a 'P' e, corrigido o cadastro, a re-execução renderizava
+# um PDF idêntico. lru_cache não aceita dict como argumento, então a
+# chave é o blake2b do JSON canônico dos dados.
+_PDF_CACHE: dict[bytes, tuple[str, bytes]] = {}
+_PDF_CACHE_MAX = 256
+# O cache é consultado pelos workers do pool de envio: lookup e
+# evicção+inserção precisam de lock para duas threads não disputarem o
+# pop da entrada mais antiga (o KeyError viraria 'falha de envio').
+_PDF_CACHE_LOCK = threading.Lock()
+
+
+def _build_pedido_pdf_cached(dados: dict) -> tuple[str, bytes]:
+    chave = hashlib.blake2b(
+        orjson.dumps(dados, option=orjson.OPT_SORT_KEYS, default=str),
+        digest_size=16,
+    ).digest()
+    with _PDF_CACHE_LOCK:
+        hit = _PDF_CACHE.get(chave)
+    if hit is not None:
+        return hit
+    # renderiza fora do lock: só a manutenção do dict é serializada
+    resultado = build_pedido_pdf(dados)
+    with _PDF_CACHE_LOCK:
+        if chave not in _PDF_CACHE and len(_PDF_CACHE) >= _PDF_CACHE_MAX:
+            # descarta a entrada mais antiga (dict preserva ordem de inserção)
+            _PDF_CACHE.pop(next(iter(_PDF_CACHE)), None)
+        _PDF_CACHE[chave] = resultado
+    return resultado
+
+
 def enviar_pdf_pedido(dados: dict, phone: str) -> dict:
     """
-    Gera o PDF do pedido e envia via Evolution API como 'document'.
+    Gera o PDF do pedido (cacheado por conteúdo) e envia via Evolution
+    API como 'document'.
     """
-    api = EvolutionAPI()
-    file_name, b64_pdf = build_pedido_pdf(dados)
+    api = get_evolution_api()
+    # bytes crus: o send_media faz o único base64 do caminho, já que o
+    # sendMedia da Evolution é JSON (não há endpoint multipart)
+    file_name, pdf_bytes = _build_pedido_pdf_cached(dados)
     return api.send_media(
         phone=phone,
         mediatype="document",
         mimetype="application/pdf",
         #caption=f"Resumo do pedido {dados['header'].get('NUMERO','')}",
         caption=f"CooperVerê - Novo Pedido Faturado",
-        media=b64_pdf,
+        media=pdf_bytes,
         file_name=file_name,
         link_preview=False,
     )
 
-def fetch_pendentes() -> list[Tuple[int, str, int]]:
+def fetch_pendentes(conn: Optional[Connection] = None) -> list[Tuple[int, str, int]]:
     """
-    Retorna (ESTAB, SERIE, NUMERO) para linhas com STATUS = 'P'
+    Retorna (ESTAB, SERIE, NUMERO) para linhas com STATUS = 'P'.
+
+    Aceita uma conexão já aberta para o lote compartilhar um checkout
+    só do pool com a consulta dos pedidos.
     """
     sql = text("""
         SELECT ESTAB, SERIE, NUMERO
@@ -47,29 +103,39 @@ def fetch_pendentes() -> list[Tuple[int, str, int]]:
         WHERE STATUS = :st AND SERIE = 'PV'
         ORDER BY DATA_CRIACAO
     """)
-    eng = create_db_engine()  # você escolheu a Opção 2
-    with eng.connect() as conn:
+    if conn is not None:
         rows = conn.execute(sql, {"st": STATUS_PENDENTE}).mappings().all()
+    else:
+        eng = get_db_engine()
+        with eng.connect() as c:
+            rows = c.execute(sql, {"st": STATUS_PENDENTE}).mappings().all()
+
+    if not rows:
+        return []
+
+    # O caso das chaves é fixo por driver: resolve uma vez na primeira
+    # linha, em vez de dois .get por campo em cada linha do backlog.
+    r0 = rows[0]
+    k_e = "ESTAB" if "ESTAB" in r0 else "estab"
+    k_s = "SERIE" if "SERIE" in r0 else "serie"
+    k_n = "NUMERO" if "NUMERO" in r0 else "numero"
 
     out: list[Tuple[int, str, int]] = []
     for r in rows:
-        estab  = r.get("ESTAB")  or r.get("estab")
-        serie  = r.get("SERIE")  or r.get("serie")
-        numero = r.get("NUMERO") or r.get("numero")
+        serie = r[k_s]
         if isinstance(serie, str):
             serie = serie.strip()
-        out.append((estab, serie, numero))
+        out.append((r[k_e], serie, r[k_n]))
     return out
 
-def run_business_query(estab: int, serie: str, numero: int) -> dict:
-    """
-    Executa a consulta do pedido + itens e retorna um dicionário com 'header' e 'items'.
-    header: dados do pedido/cliente
-    items:  lista de itens (um por linha de PEDITEM)
-    """
-    sql = text("""
-        SELECT 
+# Consulta do pedido + itens para TODOS os pendentes de uma vez: o IN de
+# tuplas (expanding) troca N round-trips (um por pedido) por um só; o
+# ORDER BY pelas chaves deixa as linhas prontas para o groupby.
+PEDIDO_SQL = text("""
+        SELECT
             PEDCAB.ESTAB,
+            PEDCAB.SERIE AS SERIE_PED,
+            PEDCAB.NUMERO AS NUMERO_PED,
             PEDCAB.STATUS, 
             PEDCFG.ENTRADASAIDA,
             PEDCAB.SERIE || '-' || PEDCAB.NUMERO AS NUMERO,
@@ -149,51 +215,111 @@ def run_business_query(estab: int, serie: str, numero: int) -> dict:
         INNER JOIN FILIAL
             ON FILIAL.ESTAB = PEDCAB.ESTAB
 
-        WHERE PEDCAB.SERIE = :SERIE
-        AND PEDCAB.NUMERO = :NUMERO
-        AND PEDCAB.ESTAB = :ESTAB
-    """)
+        WHERE (PEDCAB.ESTAB, PEDCAB.SERIE, PEDCAB.NUMERO) IN :CHAVES
 
-    eng = create_db_engine()
-    with eng.connect() as conn:
-        rows = conn.execute(sql, {"SERIE": serie, "NUMERO": numero, "ESTAB": estab}).mappings().all()
+        ORDER BY PEDCAB.ESTAB, PEDCAB.SERIE, PEDCAB.NUMERO, PEDITEM.SEQPEDITE
+    """).bindparams(bindparam("CHAVES", expanding=True))
+
+
+def run_business_query_lote(
+    chaves: list[Tuple[int, str, int]],
+    conn: Optional[Connection] = None,
+) -> dict[Tuple[int, str, int], dict]:
+    """
+    Executa a consulta do pedido + itens para todas as chaves de uma vez.
+
+    Devolve {(estab, serie, numero): {"header": ..., "items": [...]}}.
+    Antes era uma consulta por pedido (um round-trip cada); agora o lote
+    inteiro paga um único round-trip e o agrupamento é feito aqui.
+    Aceita a mesma conexão do fetch_pendentes para reusar o checkout.
+    """
+    if not chaves:
+        return {}
+
+    if conn is not None:
+        rows = conn.execute(PEDIDO_SQL, {"CHAVES": chaves}).mappings().all()
+    else:
+        eng = get_db_engine()
+        with eng.connect() as c:
+            rows = c.execute(PEDIDO_SQL, {"CHAVES": chaves}).mappings().all()
 
     if not rows:
         return {}
 
-    def _upper_keys(d):
-        return { (k.upper() if isinstance(k, str) else k): v for k, v in d.items() }
+    # O caso das chaves é fixo para um dado driver/consulta: resolve UMA
+    # vez a partir da primeira linha, em vez de copiar cada linha com as
+    # chaves maiúsculas (uma alocação de dict por linha no _upper_keys).
+    kmap = {str(k).upper(): k for k in rows[0].keys()}
+    (K_ESTAB, K_SERIE_PED, K_NUMERO_PED, K_STATUS, K_ENTRADASAIDA, K_NUMERO,
+     K_DTEMISSAO, K_DTVALIDADE, K_DTPREVISAO, K_SITUACAO, K_NOME, K_CELULAR,
+     K_ENDERECO, K_VTOTAL, K_SEQ, K_DESC, K_MARCA, K_QTD, K_UN, K_VUNIT,
+     K_VALOR) = (
+        kmap[n] for n in (
+            "ESTAB", "SERIE_PED", "NUMERO_PED", "STATUS", "ENTRADASAIDA",
+            "NUMERO", "DTEMISSAO", "DTVALIDADE", "DTPREVISAO", "SITUACAO",
+            "NOME", "CELULAR", "ENDERECO_COMP", "VALOR_TOTAL_PEDIDO",
+            "SEQPEDITE", "ITEMDESCRICAO", "MARCA", "QUANTIDADE", "UNIDADE",
+            "VALORUNITARIO", "VALOR",
+        )
+    )
+
+    out: dict[Tuple[int, str, int], dict] = {}
+    # Linhas já vêm ordenadas pelas chaves (ORDER BY), então cada grupo
+    # do groupby corresponde a um pedido completo.
+    for chave, grupo in groupby(
+        rows, key=lambda r: (r[K_ESTAB], (r[K_SERIE_PED] or "").strip(), r[K_NUMERO_PED])
+    ):
+        grupo = list(grupo)
+        r0 = grupo[0]
+        header = {
+            "ESTAB": r0[K_ESTAB],
+            "STATUS": r0[K_STATUS],
+            "ENTRADASAIDA": r0[K_ENTRADASAIDA],
+            "NUMERO": r0[K_NUMERO],
+            "DTEMISSAO": r0[K_DTEMISSAO],
+            "DTVALIDADE": r0[K_DTVALIDADE],
+            "DTPREVISAO": r0[K_DTPREVISAO],
+            "SITUACAO": r0[K_SITUACAO],
+            "NOME": r0[K_NOME],
+            "CELULAR": r0[K_CELULAR],
+            "ENDERECO_COMP": r0[K_ENDERECO],
+            "VALOR_TOTAL_PEDIDO": r0[K_VTOTAL],
+        }
+
+        items = []
+        for r in grupo:
+            items.append({
+                "SEQPEDITE": r[K_SEQ],
+                "ITEMDESCRICAO": r[K_DESC],
+                "MARCA": r[K_MARCA],
+                "QUANTIDADE": r[K_QTD],
+                "UNIDADE": r[K_UN],
+                "VALORUNITARIO": r[K_VUNIT],
+                "VALOR": r[K_VALOR],
+            })
+
+        out[chave] = {"header": header, "items": items}
 
-    rows = [_upper_keys(r) for r in rows]
-    r0 = rows[0]
-    header = {
-        "ESTAB": r0["ESTAB"],
-        "STATUS": r0["STATUS"],
-        "ENTRADASAIDA": r0["ENTRADASAIDA"],
-        "NUMERO": r0["NUMERO"],
-        "DTEMISSAO": r0["DTEMISSAO"],
-        "DTVALIDADE": r0["DTVALIDADE"],
-        "DTPREVISAO": r0["DTPREVISAO"],
-        "SITUACAO": r0["SITUACAO"],
-        "NOME": r0["NOME"],
-        "CELULAR": r0["CELULAR"],
-        "ENDERECO_COMP": r0["ENDERECO_COMP"],
-        "VALOR_TOTAL_PEDIDO": r0["VALOR_TOTAL_PEDIDO"],
-    }
+    return out
+
+# Template do item em constante de módulo: um único str.format por item
+# em vez de duas f-strings concatenadas dentro do loop.
+_ITEM_TMPL = (
+    "{i}. {desc}{marca_suffix}\n"
+    "   Qtde: {qtd} {un}  Vlr Un.: R$ {vu}  Vlr: R$ {vt}"
+)
+
+
+def fmt_data(dt):
+    """Formata data/hora para a mensagem (DD/MM/YYYY HH:MM).
+
+    No escopo do módulo: como função aninhada, o objeto-função (e sua
+    closure) era reconstruído a cada compor_mensagem.
+    """
+    if isinstance(dt, datetime):
+        return dt.strftime("%d/%m/%Y %H:%M")
+    return str(dt) if dt is not None else "-"
 
-    items = []
-    for r in rows:
-        items.append({
-            "SEQPEDITE": r["SEQPEDITE"],
-            "ITEMDESCRICAO": r["ITEMDESCRICAO"],
-            "MARCA": r["MARCA"],
-            "QUANTIDADE": r["QUANTIDADE"],
-            "UNIDADE": r["UNIDADE"],
-            "VALORUNITARIO": r["VALORUNITARIO"],
-            "VALOR": r["VALOR"],
-        })
-
-    return {"header": header, "items": items}
 
 def compor_mensagem(dados: dict) -> str:
     """
@@ -203,64 +329,73 @@ def compor_mensagem(dados: dict) -> str:
     if not dados:
         return "Nenhum dado encontrado."
 
-    def fmt_data(dt):
-        if isinstance(dt, datetime):
-            return dt.strftime("%d/%m/%Y %H:%M")
-        return str(dt) if dt is not None else "-"
-
-    def fmt_moeda(v):
-        try:
-            # Formata como pt-BR simples: 1.234,56
-            s = f"{float(v):,.2f}"
-            return s.replace(",", "X").replace(".", ",").replace("X", ".")
-        except Exception:
-            return str(v)
-
     h = dados["header"]
     itens = dados.get("items", [])
 
-    cabecalho = (
-        "📦 Olá *Pedido notificado*\n"
-        f"*Número:* {h.get('NUMERO','-')}   *Estab:* {h.get('ESTAB','-')}\n"
-        f"*Status:* {h.get('STATUS','-')}   *Situação:* {h.get('SITUACAO','-')}\n"
-        f"*Entrada/Saída:* {h.get('ENTRADASAIDA','-')}\n"
+    # Uma lista só + um join terminal: o cabeçalho como f-string gigante
+    # concatenada com o join dos itens copiava a mensagem inteira de novo.
+    parts: list[str] = []
+    parts.append("📦 Olá *Pedido notificado*")
+    parts.append(f"*Número:* {h.get('NUMERO','-')}   *Estab:* {h.get('ESTAB','-')}")
+    parts.append(f"*Status:* {h.get('STATUS','-')}   *Situação:* {h.get('SITUACAO','-')}")
+    parts.append(f"*Entrada/Saída:* {h.get('ENTRADASAIDA','-')}")
+    parts.append(
         f"*Emissão:* {fmt_data(h.get('DTEMISSAO'))}  "
         f"*Validade:* {fmt_data(h.get('DTVALIDADE'))}  "
-        f"*Previsão:* {fmt_data(h.get('DTPREVISAO'))}\n"
-        f"*Cliente:* {h.get('NOME','-')}\n"
-        f"*Endereço:* {h.get('ENDERECO_COMP','-')}\n"
-        f"*Valor total do pedido:* R$ {fmt_moeda(h.get('VALOR_TOTAL_PEDIDO'))}\n"
-        "—\n"
-        "*Itens:*"
+        f"*Previsão:* {fmt_data(h.get('DTPREVISAO'))}"
     )
+    parts.append(f"*Cliente:* {h.get('NOME','-')}")
+    parts.append(f"*Endereço:* {h.get('ENDERECO_COMP','-')}")
+    parts.append(f"*Valor total do pedido:* R$ {fmt_moeda(h.get('VALOR_TOTAL_PEDIDO'))}")
+    parts.append("—")
+    parts.append("*Itens:*")
 
     # Lista até 5 itens
-    linhas = []
     max_itens = 5
-    for i, it in enumerate(itens[:max_itens], start=1):
-        linhas.append(
-            f"{i}. {it.get('ITEMDESCRICAO','-')}"
-            f"{' ('+it['MARCA']+')' if it.get('MARCA') else ''}\n"
-            f"   Qtde: {it.get('QUANTIDADE','-')} {it.get('UNIDADE','-')}  "
-            f"Vlr Un.: R$ {fmt_moeda(it.get('VALORUNITARIO'))}  "
-            f"Vlr: R$ {fmt_moeda(it.get('VALOR'))}"
+    parts.extend(
+        _ITEM_TMPL.format(
+            i=i,
+            desc=it.get("ITEMDESCRICAO", "-"),
+            marca_suffix=f" ({it['MARCA']})" if it.get("MARCA") else "",
+            qtd=it.get("QUANTIDADE", "-"),
+            un=it.get("UNIDADE", "-"),
+            vu=fmt_moeda(it.get("VALORUNITARIO")),
+            vt=fmt_moeda(it.get("VALOR")),
         )
+        for i, it in enumerate(itens[:max_itens], start=1)
+    )
 
     resto = len(itens) - max_itens
     if resto > 0:
-        linhas.append(f"... e mais {resto} item(ns).")
+        parts.append(f"... e mais {resto} item(ns).")
+
+    return "\n".join(parts)
+
+# Compilado uma vez no import; também serve de statement para o
+# executemany do lote de atualizações.
+ATUALIZA_STATUS_SQL = text("""
+    UPDATE CV_PEDCAB_NOTIFICA
+       SET STATUS = :status
+     WHERE ESTAB = :estab AND SERIE = :serie AND NUMERO = :numero
+""")
 
-    return cabecalho + "\n" + "\n".join(linhas)
 
 def atualizar_status(estab: int, serie: str, numero: int, status: str):
-    sql = text("""
-        UPDATE CV_PEDCAB_NOTIFICA
-           SET STATUS = :status
-         WHERE ESTAB = :estab AND SERIE = :serie AND NUMERO = :numero
-    """)
-    eng = create_db_engine()
+    eng = get_db_engine()
+    with eng.begin() as conn:
+        conn.execute(ATUALIZA_STATUS_SQL, {"status": status, "estab": estab, "serie": serie, "numero": numero})
+
+
+def atualizar_status_lote(updates: list[dict]) -> None:
+    """Aplica todas as mudanças de status numa transação só (executemany).
+
+    Um begin/commit por pedido custava 2N round-trips por lote.
+    """
+    if not updates:
+        return
+    eng = get_db_engine()
     with eng.begin() as conn:
-        conn.execute(sql, {"status": status, "estab": estab, "serie": serie, "numero": numero})
+        conn.execute(ATUALIZA_STATUS_SQL, updates)
 
 def processar_pedidos_pendentes() -> dict:
     """
@@ -272,53 +407,84 @@ def processar_pedidos_pendentes() -> dict:
     - Atualiza STATUS para 'E' (enviado) ou 'P' (pendente para que ocorra nova tentativa de envio depois da correção do número)
     """
 
-    evo = EvolutionAPI()
-    pendentes = fetch_pendentes()
+    # Uma conexão só para a fase de leitura: backlog + dados dos pedidos
+    # saem do mesmo checkout do pool. A escrita (status em lote) fica
+    # fora, na sua própria transação após os envios.
+    eng = get_db_engine()
+    with eng.connect() as conn:
+        pendentes = fetch_pendentes(conn)
+        dados_por_pedido = run_business_query_lote(pendentes, conn)
 
     ok, fail = 0, 0
 
+    # Mudanças de status acumuladas e gravadas numa transação só no fim
+    updates: list[dict] = []
+
+    def _marcar(estab, serie, numero, status):
+        updates.append({"status": status, "estab": estab, "serie": serie, "numero": numero})
+
+    # ================================
+    # Fase 1 (DB/CPU, serial): resolve dados e celular de cada pedido;
+    # só os envios (I/O puro) seguem para o pool.
+    # ================================
+    enviaveis: list[tuple[Tuple[int, str, int], dict, str]] = []
     for estab, serie, numero in pendentes:
         try:
-            # Consulta dados completos do pedido
-            dados = run_business_query(estab, serie, numero)
+            # Dados completos do pedido (pré-buscados em lote)
+            dados = dados_por_pedido.get((estab, serie, numero))
             if not dados:
                 raise RuntimeError("Consulta não retornou dados para compor a mensagem.")
 
             header = dados["header"]
 
-            # ================================
-            # 1) Obter celular do cliente
-            # ================================
             raw_phone = (header.get("CELULAR") or "").strip()
             phone = normalizar_celular_br(raw_phone)
 
             if not phone:
-                # Celular inválido → marca falha + avisa TI
-                atualizar_status(estab, serie, numero, STATUS_PENDENTE)
+                # Celular inválido → segue pendente + avisa TI
+                _marcar(estab, serie, numero, STATUS_PENDENTE)
                 print(f"[WARN] Pedido {numero}: celular inválido '{raw_phone}'")
 
                 notificar_ti_pedido_sem_celular(header)
                 fail += 1
                 continue
 
-            # ================================
-            # 2) Enviar PDF do pedido
-            # ================================
-            enviar_pdf_pedido(dados, phone)
-
-            # Sucesso
-            atualizar_status(estab, serie, numero, STATUS_ENVIADO)
-            ok += 1
+            enviaveis.append(((estab, serie, numero), dados, phone))
 
         except Exception as e:
             print(f"[ERRO] {estab}-{serie}-{numero}: {e}")
+            _marcar(estab, serie, numero, STATUS_FALHA)
+            fail += 1
 
-            try:
-                atualizar_status(estab, serie, numero, STATUS_FALHA)
-            except Exception:
-                pass
+    # ================================
+    # Fase 2 (I/O): gera e envia os PDFs em paralelo. O rate limit do
+    # cliente Evolution continua valendo (régua compartilhada).
+    # ================================
+    def _enviar(item):
+        chave, dados, phone = item
+        try:
+            enviar_pdf_pedido(dados, phone)
+            return chave, None
+        except Exception as e:
+            return chave, e
+
+    if enviaveis:
+        with ThreadPoolExecutor(max_workers=ENVIO_MAX_WORKERS) as pool:
+            resultados = list(pool.map(_enviar, enviaveis))
+
+        for (estab, serie, numero), erro in resultados:
+            if erro is None:
+                _marcar(estab, serie, numero, STATUS_ENVIADO)
+                ok += 1
+            else:
+                print(f"[ERRO] {estab}-{serie}-{numero}: {erro}")
+                _marcar(estab, serie, numero, STATUS_FALHA)
+                fail += 1
 
-            fail += 1
+    try:
+        atualizar_status_lote(updates)
+    except Exception as e:
+        print(f"[ERRO] Falha ao gravar status do lote: {e}")
 
     return {
         "enviados": ok,
@@ -326,11 +492,16 @@ def processar_pedidos_pendentes() -> dict:
         "total": len(pendentes),
     }
 
+@lru_cache(maxsize=10_000)
 def normalizar_celular_br(raw: str, ddd_default: str = "46") -> str | None:
     """
     Normaliza número de celular brasileiro para o formato:
     55 + DDD (2 dígitos) + número (9 dígitos).
 
+    Função pura (regex + fatias de string), então o resultado é memoizado:
+    o mesmo telefone aparece repetido entre cobranças/aniversários e em
+    reexecuções dentro do mesmo processo.
+
     Regras:
     - Remove tudo que não for número.
     - Se não tiver DDD, usa ddd_default.
@@ -344,16 +515,24 @@ def normalizar_celular_br(raw: str, ddd_default: str = "46") -> str | None:
     if not raw:
         return None
 
-    # só dígitos
-    digits = re.sub(r"\D", "", raw)
+    # entradas absurdamente longas são lixo de cadastro
+    if len(raw) > 20:
+        return None
+
+    # só dígitos — atalho C para o caso comum (CELULAR do banco já vem
+    # limpo), sem pagar o setup da VM de regex
+    if raw.isdigit():
+        digits = raw
+    else:
+        digits = _NON_DIGIT_RE.sub("", raw)
 
     # descarta entradas muito curtas
     if len(digits) < 8:
         return None
 
-    # remove zeros à esquerda (ex: 046..., 054...)
-    while digits.startswith("0"):
-        digits = digits[1:]
+    # remove zeros à esquerda (ex: 046..., 054...) numa passada só,
+    # em vez do while que realocava a string a cada zero
+    digits = digits.lstrip("0")
 
     # remove prefixo 55 se já vier
     if digits.startswith("55"):
@@ -408,7 +587,7 @@ def notificar_ti_pedido_sem_celular(
              celular_original="(46) 99999-9999"
          )
     """
-    ti_phone_raw = os.getenv("TI_NOTIFY_PHONE", "").strip()
+    ti_phone_raw = _TI_NOTIFY_PHONE_RAW
     if not ti_phone_raw:
         print("[WARN] TI_NOTIFY_PHONE não definido no .env – não será possível avisar o TI.")
         return
@@ -416,18 +595,20 @@ def notificar_ti_pedido_sem_celular(
     # Normaliza o celular do TI (se puder)
     ti_phone = normalizar_celular_br(ti_phone_raw) or ti_phone_raw
 
-    # Se veio um header, usamos como fallback para os campos
+    # Se veio um header, usamos como fallback para os campos. O header
+    # sai do run_business_query_lote com chaves maiúsculas canônicas,
+    # então o segundo .get minúsculo era um lookup morto por campo.
     if header:
         if identificador is None:
-            numero = (header.get("NUMERO") or header.get("numero") or "-")
-            serie = (header.get("SERIE") or header.get("serie") or "")
+            numero = header.get("NUMERO") or "-"
+            serie = header.get("SERIE") or ""
             identificador = f"{serie}-{numero}" if serie else numero
 
         if nome_cliente is None:
-            nome_cliente = header.get("NOME") or header.get("nome") or "Cliente não informado"
+            nome_cliente = header.get("NOME") or "Cliente não informado"
 
         if celular_original is None:
-            celular_original = header.get("CELULAR") or header.get("celular") or "-"
+            celular_original = header.get("CELULAR") or "-"
 
     # Defaults caso ainda não tenham sido preenchidos
     contexto = contexto or "Pedido"
@@ -440,7 +621,7 @@ def notificar_ti_pedido_sem_celular(
         f"por inconsistências no número do celular ({celular_original}). Verifique!"
     )
 
-    api = EvolutionAPI()
+    api = get_evolution_api()
     try:
         api.send_text(phone=ti_phone, text=texto)
         print(
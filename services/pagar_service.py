@@ -1,41 +1,60 @@
 # coopervere/services/pagar_service.py
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 from collections import defaultdict
-from collections import defaultdict
+from itertools import chain
 
-from dotenv import load_dotenv
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
-from .database import create_db_engine
-from .evolution_api import EvolutionAPI
+from .database import get_db_engine
+from .evolution_api import get_evolution_api
 from .pdf_utils import fmt_moeda, fmt_data
 
-load_dotenv()
+from . import _bootstrap  # noqa: F401  (parse único do .env)
 
-def get_pay_notify_phones() -> list[str]:
-    """
-    Lê PAY_NOTIFY_PHONES ou PAY_NOTIFY_PHONE do .env e
-    devolve uma lista de números limpos.
-    """
+# Poucos destinatários por rodada; 8 threads cobrem o caso com folga.
+PAY_MAX_WORKERS = int(os.getenv("PAY_MAX_WORKERS", "8"))
+
+# Parâmetros do relatório lidos/parseados UMA vez no import (o .env não
+# muda com o processo de pé), em vez de re-split a cada rodada.
+PAY_REPORT_RANGE_DAYS = int(os.getenv("PAY_REPORT_RANGE_DAYS", "7"))
+PAY_REPORT_START_OFFSET_DAYS = int(os.getenv("PAY_REPORT_START_OFFSET_DAYS", "0"))
+
+
+def _parse_notify_phones() -> tuple[str, ...]:
     raw = os.getenv("PAY_NOTIFY_PHONES") or os.getenv("PAY_NOTIFY_PHONE", "")
     if not raw:
-        return []
+        return ()
 
     # suporta vírgula ou ponto-e-vírgula
     partes = raw.replace(";", ",").split(",")
-    phones = [p.strip() for p in partes if p.strip()]
-    return phones
+    return tuple(p.strip() for p in partes if p.strip())
+
 
+_PAY_NOTIFY_PHONES = _parse_notify_phones()
 
-def buscar_contas_pagar(dt_ini: datetime, dt_fim: datetime):
+
+def get_pay_notify_phones() -> list[str]:
     """
-    Executa a query de contas a pagar no intervalo informado.
-    Retorna uma lista de dicts (uma linha por duplicata).
+    Devolve os números configurados em PAY_NOTIFY_PHONES (ou
+    PAY_NOTIFY_PHONE), parseados uma única vez no import.
     """
-    sql = text("""
+    return list(_PAY_NOTIFY_PHONES)
+
+
+# Agregação no banco: o relatório só precisa do total por
+# (vencimento, fornecedor), então o SUM/GROUP BY externo evita trafegar
+# milhares de duplicatas individuais para somar em Python.
+CONTAS_PAGAR_SQL = text("""
+        SELECT
+            DUPS.DTVENCTO,
+            DUPS.ID_FORNECEDOR,
+            DUPS.NOME_FORNECEDOR,
+            SUM(DUPS.SALDO) AS SALDO
+        FROM (
         SELECT DISTINCT
             PDUPPAGA.FORNECEDOR AS ID_FORNECEDOR,
             PPESSFOR.NOME AS NOME_FORNECEDOR,
@@ -123,16 +142,28 @@ ON 0=0
 
  WHERE (PDUPPAGA.EMPRESA = 1) AND (PANALITI.ATIVA = 'S') AND
  (PDUPPAGA.DTVENCTO between :DTVENCTOINI and :DTVENCTOFIM) AND ((PDUPPAGA.QUITADA = 'N') OR (PDUPPAGA.QUITADA IS NULL)) AND ((CONTAMOV.MATFUNCIONARIO = '') OR (CONTAMOV.MATFUNCIONARIO IS NULL))
+        ) DUPS
+        GROUP BY DUPS.DTVENCTO, DUPS.ID_FORNECEDOR, DUPS.NOME_FORNECEDOR
+        ORDER BY DUPS.DTVENCTO, DUPS.NOME_FORNECEDOR
     """)
 
-    eng = create_db_engine()
-    with eng.connect() as conn:
-        rows = conn.execute(sql, {
-            "DTVENCTOINI": dt_ini.strftime("%Y-%m-%d"),
-            "DTVENCTOFIM": dt_fim.strftime("%Y-%m-%d"),
-        }).mappings().all()
 
-    return [dict(r) for r in rows]
+def buscar_contas_pagar(dt_ini: date, dt_fim: date):
+    """
+    Executa a query de contas a pagar no intervalo informado.
+    Itera as linhas via cursor server-side (uma por fornecedor/vencimento,
+    com o saldo já somado pelo banco): o .mappings().all() + [dict(r)...]
+    antigo materializava o resultado inteiro duas vezes antes de agregar.
+    """
+    eng = get_db_engine()
+    with eng.connect() as conn:
+        # date direto no bind: o driver serializa nativamente, sem o
+        # strftime aqui + parse da string de volta no banco
+        result = conn.execution_options(stream_results=True, yield_per=500).execute(
+            CONTAS_PAGAR_SQL, {"DTVENCTOINI": dt_ini, "DTVENCTOFIM": dt_fim}
+        )
+        for row in result.mappings():
+            yield dict(row)
 
 
 def agrupar_por_fornecedor_e_data(linhas):
@@ -150,20 +181,32 @@ def agrupar_por_fornecedor_e_data(linhas):
     }
     Ou seja: primeiro por data, depois por fornecedor.
     """
-    agrupado = defaultdict(lambda: defaultdict(float))
-
-    for r in linhas:
-        # nomes em minúsculo, conforme debug:
-        # {'id_fornecedor': ..., 'nome_fornecedor': ..., 'dtvencto': ..., 'saldo': ...}
-        fornecedor = r.get("nome_fornecedor") or "Fornecedor não informado"
-
-        dt_key = parse_date(r.get("dtvencto"))
+    # O SUM/GROUP BY grosso já saiu do banco, mas o agrupamento lá é por
+    # (vencimento, id, nome) e aqui o rótulo é só o nome: dois IDs com o
+    # mesmo nome (ou ambos sem nome) ainda precisam somar, não sobrescrever.
+    agrupado = defaultdict(dict)
+
+    # O caso das chaves (minúsculo no pymysql, conforme debug) é fixo
+    # por driver: resolve uma vez na primeira linha do gerador.
+    it = iter(linhas)
+    first = next(it, None)
+    if first is None:
+        return agrupado
+
+    k_nome = "nome_fornecedor" if "nome_fornecedor" in first else "NOME_FORNECEDOR"
+    k_dt = "dtvencto" if "dtvencto" in first else "DTVENCTO"
+    k_saldo = "saldo" if "saldo" in first else "SALDO"
+
+    for r in chain((first,), it):
+        fornecedor = r[k_nome] or "Fornecedor não informado"
+
+        dt_key = parse_date(r[k_dt])
         if not dt_key:
             # pula registros com data inválida
             continue
 
-        valor = float(r.get("saldo") or 0)
-        agrupado[dt_key][fornecedor] += valor
+        por_forn = agrupado[dt_key]
+        por_forn[fornecedor] = por_forn.get(fornecedor, 0.0) + float(r[k_saldo] or 0)
 
     return agrupado
 
@@ -193,10 +236,12 @@ def montar_mensagem_contas(agrupado: dict, dias: int, dt_ini: datetime, dt_fim:
         msg.append("\nNão há compromissos previstos neste período.")
         return "\n".join(msg)
 
-    # datas em ordem do vencimento mais próximo (mais antigo) para o mais distante
-    for dt in sorted(agrupado.keys()):
+    # datas em ordem do vencimento mais próximo (mais antigo) para o mais
+    # distante: o ORDER BY da consulta já entrega nessa ordem e os dicts
+    # preservam a ordem de inserção, então os sorted() viraram no-ops
+    for dt, fornecedores in agrupado.items():
         msg.append(f"\n*Vencimento:* {fmt_data(dt)}")
-        for fornecedor, valor in sorted(agrupado[dt].items(), key=lambda x: x[0]):
+        for fornecedor, valor in fornecedores.items():
             msg.append(f"   - {fornecedor} – R$ {fmt_moeda(valor)}")
 
     return "\n".join(msg)
@@ -215,25 +260,31 @@ def processar_contas_pagar() -> dict:
     if not phones:
         raise RuntimeError("PAY_NOTIFY_PHONES ou PAY_NOTIFY_PHONE não definido no .env")
 
-    dias = int(os.getenv("PAY_REPORT_RANGE_DAYS", "7"))
-    offset = int(os.getenv("PAY_REPORT_START_OFFSET_DAYS", "0"))
+    dias = PAY_REPORT_RANGE_DAYS
+    offset = PAY_REPORT_START_OFFSET_DAYS
 
     dt_ini = datetime.now().date() + timedelta(days=offset)
     dt_fim = dt_ini + timedelta(days=dias - 1)
 
-    linhas = buscar_contas_pagar(dt_ini, dt_fim)
-    agrupado = agrupar_por_fornecedor_e_data(linhas)
+    # buscar_contas_pagar é um gerador: as linhas fluem direto para o
+    # agrupamento sem materializar uma lista intermediária.
+    agrupado = agrupar_por_fornecedor_e_data(buscar_contas_pagar(dt_ini, dt_fim))
     mensagem = montar_mensagem_contas(agrupado, dias, dt_ini, dt_fim)
 
-    evo = EvolutionAPI()
+    evo = get_evolution_api()
 
-    for phone in phones:
+    # O mesmo relatório vai para todos os destinatários: os POSTs saem
+    # em paralelo (I/O puro) em vez de um atrás do outro.
+    def _enviar(phone: str) -> None:
         try:
             evo.send_text(phone, mensagem)
             print(f"[Payables] Relatório enviado para {phone}")
         except Exception as e:
             print(f"[Payables][ERRO] ao enviar para {phone}: {e}")
 
+    with ThreadPoolExecutor(max_workers=PAY_MAX_WORKERS) as pool:
+        list(pool.map(_enviar, phones))
+
     #print("\n=== DEBUG CAMPOS DA QUERY ===")
     #print("Primeira linha:", linhas[0] if linhas else "Nenhuma")
 
@@ -241,7 +292,7 @@ def processar_contas_pagar() -> dict:
         "intervalo_inicio": str(dt_ini),
         "intervalo_fim": str(dt_fim),
         "fornecedores": len(agrupado),
-        "total_linhas": len(linhas),
+        "total_linhas": sum(len(f) for f in agrupado.values()),
         "destinatarios": phones,
     }
 
@@ -259,14 +310,21 @@ def parse_date(dt):
     if isinstance(dt, (date, datetime)):
         return dt if isinstance(dt, date) and not isinstance(dt, datetime) else dt.date()
 
-    # Se for string
+    # Se for string: os três formatos aceitos são distinguíveis pelo
+    # tamanho/separador, então dá para despachar direto para o parser
+    # certo (fromisoformat é caminho C, ~10x o strptime) sem a cadeia
+    # de try/except por formato.
     if isinstance(dt, str):
         s = dt.strip()
-        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S"):
-            try:
-                return datetime.strptime(s, fmt).date()
-            except ValueError:
-                continue
+        try:
+            if len(s) == 10 and s[4] == "-":          # YYYY-MM-DD
+                return date.fromisoformat(s)
+            if len(s) >= 19 and s[4] == "-":          # YYYY-MM-DD HH:MM:SS
+                return datetime.fromisoformat(s[:19]).date()
+            if len(s) == 10 and s[2] == "/":          # DD/MM/YYYY
+                return date(int(s[6:10]), int(s[3:5]), int(s[0:2]))
+        except ValueError:
+            pass
 
     # Não reconheceu
     print("[AVISO] Data não reconhecida em parse_date:", dt, type(dt))
@@ -1,45 +1,77 @@
 # services/pdf_utils.py
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date
-import base64
+from functools import lru_cache
 import os
+import re
 
 # pip install reportlab
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 from reportlab.lib.colors import black
-from reportlab.lib.utils import simpleSplit
+from reportlab.lib.utils import ImageReader, simpleSplit
+
+
+# Logo decodificado UMA vez por processo: passar o caminho ao drawImage
+# fazia o ReportLab reabrir e reparsear o PNG a cada PDF gerado.
+_LOGO_PATH = os.path.join(os.path.dirname(__file__), "LogoLima.png")
+_LOGO_READER: ImageReader | None = None
+
+
+def _get_logo() -> ImageReader | None:
+    global _LOGO_READER
+    if _LOGO_READER is None and os.path.exists(_LOGO_PATH):
+        _LOGO_READER = ImageReader(_LOGO_PATH)
+    return _LOGO_READER
 
 
 # ---------------------------
 # Helpers de formatação
 # ---------------------------
-def fmt_moeda(v) -> str:
-    """Formata número como moeda pt-BR (1.234,56)."""
+
+# Troca , <-> . numa passada só em C: os três .replace encadeados com o
+# "X" sentinela alocavam três strings intermediárias por número.
+_PTBR_MONEY_TABLE = str.maketrans({",": ".", ".": ","})
+
+
+def _fmt_num_ptbr(v) -> str:
     try:
-        s = f"{float(v):,.2f}"
-        return s.replace(",", "X").replace(".", ",").replace("X", ".")
+        return f"{float(v):,.2f}".translate(_PTBR_MONEY_TABLE)
     except Exception:
         return str(v)
 
 
+# Valores se repetem muito num pedido (zeros, mesmo preço unitário em
+# vários itens, mesmas datas de emissão/validade), então o resultado é
+# memoizado; entrada não-hasheável cai no caminho direto.
+_fmt_num_cached = lru_cache(maxsize=1024)(_fmt_num_ptbr)
+
+
+def fmt_moeda(v) -> str:
+    """Formata número como moeda pt-BR (1.234,56)."""
+    try:
+        return _fmt_num_cached(v)
+    except TypeError:
+        return _fmt_num_ptbr(v)
+
+
 def fmt_qtd(v) -> str:
     """Formata quantidade com duas casas no padrão pt-BR."""
     try:
-        s = f"{float(v):,.2f}"
-        return s.replace(",", "X").replace(".", ",").replace("X", ".")
-    except Exception:
-        return str(v)
-    
+        return _fmt_num_cached(v)
+    except TypeError:
+        return _fmt_num_ptbr(v)
 
 
 
-def fmt_data(dt) -> str:
-    """
-    Formata para DD/MM/YYYY.
-    Aceita: datetime, date, ou string ISO (ex.: 2025-05-27, 2025-05-27 14:30:00, 2025-05-27T14:30:00, com/sem milissegundos).
-    """
+
+# Fração de segundo (".0000", ".123456") removida numa passada só
+_FRACTION_RE = re.compile(r"\.\d+")
+
+
+def _fmt_data_raw(dt) -> str:
     if dt is None:
         return "-"
 
@@ -55,41 +87,106 @@ def fmt_data(dt) -> str:
         s = dt.strip()
         # Normaliza T -> espaço
         s = s.replace("T", " ")
-        # Remove fração de segundo, se houver (ex.: ".0000", ".123456")
+        # Remove fração de segundo, se houver
         if "." in s:
-            s = s.split(".", 1)[0]
-
-        # Tenta vários formatos comuns
-        patterns = [
-            "%Y-%m-%d %H:%M:%S",
-            "%Y-%m-%d",              # só data
-            "%Y/%m/%d %H:%M:%S",
-            "%Y/%m/%d",
-        ]
-        for p in patterns:
+            s = _FRACTION_RE.sub("", s, count=1)
+
+        # ISO primeiro: só a data importa, então os 10 primeiros chars
+        # cobrem data pura e data+hora pelo fromisoformat (caminho C,
+        # sem a cadeia de strptime)
+        try:
+            return date.fromisoformat(s[:10]).strftime("%d/%m/%Y")
+        except ValueError:
+            pass
+
+        # Variantes com barra (YYYY/MM/DD, com/sem hora)
+        for p in ("%Y/%m/%d %H:%M:%S", "%Y/%m/%d"):
             try:
-                dtp = datetime.strptime(s, p)
-                return dtp.strftime("%d/%m/%Y")
+                return datetime.strptime(s, p).strftime("%d/%m/%Y")
             except ValueError:
                 pass
 
-        # Último recurso: tenta fromisoformat
-        try:
-            dtp = datetime.fromisoformat(dt.replace("T", " "))
-            return dtp.strftime("%d/%m/%Y")
-        except Exception:
-            return dt  # mantém como veio, se for formato inesperado
+        return dt  # mantém como veio, se for formato inesperado
 
     return str(dt)
 
 
+_fmt_data_cached = lru_cache(maxsize=1024)(_fmt_data_raw)
+
+
+def fmt_data(dt) -> str:
+    """
+    Formata para DD/MM/YYYY (memoizado — as mesmas datas de emissão/
+    validade/previsão se repetem pelo pedido inteiro).
+    Aceita: datetime, date, ou string ISO (ex.: 2025-05-27, 2025-05-27 14:30:00, 2025-05-27T14:30:00, com/sem milissegundos).
+    """
+    try:
+        return _fmt_data_cached(dt)
+    except TypeError:
+        return _fmt_data_raw(dt)
+
+
 # ---------------------------
 # Geração do PDF
 # ---------------------------
-def build_pedido_pdf(dados: dict) -> tuple[str, str]:
+
+# Geometria fixa da página e da tabela de itens, calculada uma vez no
+# import: larguras (mm) de Seq, Descrição, Qtde, Unid., Vlr Un., Vlr,
+# ajustadas para dar mais espaço aos valores e reduzir a descrição.
+_PAGE_W, _PAGE_H = A4
+_MARGEM = 15 * mm
+_COL_WIDTHS_MM = (15, 70, 20, 20, 25, 25)
+_COL_WIDTHS = tuple(w * mm for w in _COL_WIDTHS_MM)
+
+# Posições absolutas: borda esquerda de cada coluna (para drawString) e
+# borda direita (para drawRightString)
+_COL_LEFT = []
+_COL_RIGHT = []
+_acc = _MARGEM
+for _w in _COL_WIDTHS:
+    _COL_LEFT.append(_acc)
+    _acc += _w
+    _COL_RIGHT.append(_acc)
+_COL_LEFT = tuple(_COL_LEFT)
+_COL_RIGHT = tuple(_COL_RIGHT)
+del _acc, _w
+
+
+@lru_cache(maxsize=2048)
+def _wrap_desc(texto: str) -> tuple:
+    """Quebra de linha da descrição, memoizada.
+
+    O simpleSplit mede a largura caractere a caractere em Python puro;
+    o mesmo produto aparece em vários pedidos (e às vezes repetido no
+    mesmo), então o resultado é cacheado por texto. A largura da coluna
+    é fixa (_COL_WIDTHS[1]), por isso não entra na chave.
+    """
+    return tuple(simpleSplit(texto, "Helvetica", 10, _COL_WIDTHS[1]))
+
+
+def _draw_table_header(c, y: float) -> float:
+    """Desenha o cabeçalho da tabela de itens e retorna o novo y."""
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(_COL_LEFT[0], y, "Seq")
+    c.drawString(_COL_LEFT[1], y, "Descrição (Marca)")
+    c.drawRightString(_COL_RIGHT[2], y, "Qtde")
+    c.drawRightString(_COL_RIGHT[3], y, "Unid.")
+    c.drawRightString(_COL_RIGHT[4], y, "Vlr Un.")
+    c.drawRightString(_COL_RIGHT[5], y, "Vlr Total")
+    y -= 6 * mm
+    c.setStrokeColor(black)
+    c.line(_MARGEM, y, _PAGE_W - _MARGEM, y)
+    y -= 4 * mm
+    c.setFont("Helvetica", 10)
+    return y
+
+
+def build_pedido_pdf_stream(dados: dict, out) -> str:
     """
-    Gera um PDF (em memória) com cabeçalho do pedido e tabela de itens.
-    Retorna (file_name, base64_pdf).
+    Gera o PDF do pedido escrevendo direto no stream `out` (qualquer
+    file-like binário: arquivo, BytesIO, corpo de resposta HTTP).
+    Retorna o file_name. Escrever direto evita manter uma cópia extra
+    do PDF quando o destino final já é um stream.
     Adequações:
       1) Quantidade com 2 casas no padrão pt-BR
       2) Mais espaço para Vlr Un. e Vlr; menos para Descrição
@@ -103,8 +200,9 @@ def build_pedido_pdf(dados: dict) -> tuple[str, str]:
     header = dados["header"]
     items = dados.get("items", [])
 
-    buf = BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
+    # pageCompression=1: content streams saem comprimidos com zlib —
+    # menos bytes para base64 e para o envio via Evolution.
+    c = canvas.Canvas(out, pagesize=A4, pageCompression=1)
     width, height = A4
 
     # Margens e coordenadas iniciais
@@ -125,10 +223,10 @@ def build_pedido_pdf(dados: dict) -> tuple[str, str]:
     # Logo (opcional) no canto superior direito
     # Recomendação: 30x20 mm (~300x200 px), PNG com fundo transparente.
     LOGO_W, LOGO_H = 30 * mm, 20 * mm
-    logo_path = os.path.join(os.path.dirname(__file__), "LogoLima.png")
-    if os.path.exists(logo_path):
+    logo = _get_logo()
+    if logo is not None:
         c.drawImage(
-            logo_path,
+            logo,
             width - M - LOGO_W,
             y - (LOGO_H - 4 * mm),  # sobe um pouco para alinhar com o título
             width=LOGO_W,
@@ -174,41 +272,9 @@ def build_pedido_pdf(dados: dict) -> tuple[str, str]:
     y -= 6 * mm
 
     # ---------------------------
-    # Definição das colunas
+    # Cabeçalho da tabela (geometria em _COL_LEFT/_COL_RIGHT)
     # ---------------------------
-    # Larguras (mm): Seq, Descrição, Qtde, Unid., Vlr Un., Vlr
-    # Ajustadas para dar mais espaço aos valores e reduzir a descrição.
-    widths_mm = [15, 70, 20, 20, 25, 25]
-    widths = [w * mm for w in widths_mm]
-
-    # Bordas direitas (para alinhamento à direita)
-    col_right = []
-    acc = x0
-    for w in widths:
-        acc += w
-        col_right.append(acc)
-
-    # Posições iniciais de cada coluna (esquerda)
-    col_left = [x0]
-    acc = x0
-    for i, w in enumerate(widths[:-1]):
-        acc += w
-        col_left.append(acc)
-
-    # ---------------------------
-    # Cabeçalho da tabela
-    # ---------------------------
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(col_left[0], y, "Seq")
-    c.drawString(col_left[1], y, "Descrição (Marca)")
-    c.drawRightString(col_right[2], y, "Qtde")
-    c.drawRightString(col_right[3], y, "Unid.")
-    c.drawRightString(col_right[4], y, "Vlr Un.")
-    c.drawRightString(col_right[5], y, "Vlr Total")
-    y -= 6 * mm
-    draw_line(y)
-    y -= 4 * mm
-    c.setFont("Helvetica", 10)
+    y = _draw_table_header(c, y)
 
     def maybe_new_page():
         nonlocal y
@@ -219,57 +285,48 @@ def build_pedido_pdf(dados: dict) -> tuple[str, str]:
             c.setFont("Helvetica-Bold", 12)
             c.drawString(x0, y, "Pedido (itens) — continuação")
             y -= 10 * mm
-            c.setFont("Helvetica", 10)
 
             # Reimprimir cabeçalho da tabela na nova página
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(col_left[0], y, "Seq")
-            c.drawString(col_left[1], y, "Descrição (Marca)")
-            c.drawRightString(col_right[2], y, "Qtde")
-            c.drawRightString(col_right[3], y, "Unid.")
-            c.drawRightString(col_right[4], y, "Vlr Un.")
-            c.drawRightString(col_right[5], y, "Vlr Total")
-            y -= 6 * mm
-            draw_line(y)
-            y -= 4 * mm
-            c.setFont("Helvetica", 10)
+            y = _draw_table_header(c, y)
 
     # ---------------------------
     # Linhas da tabela
     # ---------------------------
+    # Passo 1 (só formatação): resolve strings e quebras de descrição em
+    # loop apertado, sem intercalar com chamadas de canvas — o loop de
+    # desenho abaixo fica só com primitivas do ReportLab.
+    prepared = []
     for it in items:
-        maybe_new_page()
-
-        # Descrição (quebra automática)
         desc = it.get("ITEMDESCRICAO", "-")
         marca = it.get("MARCA")
         if marca:
             desc = f"{desc} ({marca})"
-
-        # Largura efetiva da coluna de descrição
-        desc_width = widths[1]
-        desc_lines = simpleSplit(desc, "Helvetica", 10, desc_width)
-
-        # Valores formatados
-        seq = str(it.get("SEQPEDITE", ""))
-        qt = fmt_qtd(it.get("QUANTIDADE", ""))
-        un = str(it.get("UNIDADE", "") or "")
-        vlu = fmt_moeda(it.get("VALORUNITARIO"))
-        vl = fmt_moeda(it.get("VALOR"))
+        prepared.append((
+            str(it.get("SEQPEDITE", "")),
+            _wrap_desc(str(desc)),
+            fmt_qtd(it.get("QUANTIDADE", "")),
+            str(it.get("UNIDADE", "") or ""),
+            fmt_moeda(it.get("VALORUNITARIO")),
+            fmt_moeda(it.get("VALOR")),
+        ))
+
+    # Passo 2 (só desenho)
+    for seq, desc_lines, qt, un, vlu, vl in prepared:
+        maybe_new_page()
 
         # Primeira linha
-        c.drawString(col_left[0], y, seq)
-        c.drawString(col_left[1], y, desc_lines[0])
-        c.drawRightString(col_right[2], y, qt)
-        c.drawRightString(col_right[3], y, un)
-        c.drawRightString(col_right[4], y, vlu)
-        c.drawRightString(col_right[5], y, vl)
+        c.drawString(_COL_LEFT[0], y, seq)
+        c.drawString(_COL_LEFT[1], y, desc_lines[0])
+        c.drawRightString(_COL_RIGHT[2], y, qt)
+        c.drawRightString(_COL_RIGHT[3], y, un)
+        c.drawRightString(_COL_RIGHT[4], y, vlu)
+        c.drawRightString(_COL_RIGHT[5], y, vl)
         y -= 6 * mm
 
         # Linhas extras da descrição
         for extra in desc_lines[1:]:
             maybe_new_page()
-            c.drawString(col_left[1], y, extra)
+            c.drawString(_COL_LEFT[1], y, extra)
             y -= 6 * mm
 
         y -= 2 * mm
@@ -278,9 +335,34 @@ def build_pedido_pdf(dados: dict) -> tuple[str, str]:
     c.showPage()
     c.save()
 
-    pdf_bytes = buf.getvalue()
-    buf.close()
+    return f"Pedido_{header.get('NUMERO','s-n')}.pdf"
 
-    b64 = base64.b64encode(pdf_bytes).decode("utf-8")
-    file_name = f"Pedido_{header.get('NUMERO','s-n')}.pdf"
-    return file_name, b64
+
+def build_pedido_pdf(dados: dict) -> tuple[str, bytes]:
+    """
+    Variante em memória de build_pedido_pdf_stream.
+    Retorna (file_name, pdf_bytes) — o base64 exigido pelo sendMedia é
+    gerado uma única vez dentro do cliente Evolution, então devolver os
+    bytes crus evita carregar a cópia inflada (+33%) junto com o PDF.
+    """
+    buf = BytesIO()
+    file_name = build_pedido_pdf_stream(dados, buf)
+    return file_name, buf.getvalue()
+
+
+def build_pedidos_pdfs_parallel(dados_list: list[dict]) -> list[tuple[str, bytes]]:
+    """
+    Renderiza vários PDFs de pedido em paralelo, um processo por núcleo.
+
+    Mesmo racional do gerar_danfe_batch: o ReportLab é Python puro e
+    preso ao GIL, então em lote (vários pedidos faturados de uma vez) o
+    ganho escala com os núcleos. Lotes pequenos não compensam o fork —
+    abaixo de 2 itens renderiza inline. Caches de logo/wrap são por
+    worker (recriados no primeiro uso de cada processo).
+    """
+    if not dados_list:
+        return []
+    if len(dados_list) < 2:
+        return [build_pedido_pdf(dados_list[0])]
+    with ProcessPoolExecutor() as ex:
+        return list(ex.map(build_pedido_pdf, dados_list))
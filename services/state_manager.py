@@ -1,8 +1,10 @@
 # services/state_manager.py
 import os
 from datetime import date
+import tempfile
 from typing import Optional
-import json
+
+import orjson
 
 # Caminho do arquivo de estado.
 # __file__ -> services/state_manager.py
@@ -12,7 +14,33 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 STATE_DIR = os.path.join(PROJECT_ROOT, "state")
 STATE_FILE_SEMANA = os.path.join(STATE_DIR, "ultima_execucao_semana.txt")
 STATE_FILE_ANIVERSARIOS = os.path.join(STATE_DIR, "aniversarios_enviados.json")
-STATE_FILE_FESTIVIDADES = os.path.join(STATE_DIR, "festividades_enviados.json")
+
+# Cache em memória dos arquivos de estado, chaveado por mtime: enquanto
+# o arquivo não mudar no disco, os loaders devolvem o valor já parseado
+# em vez de reabrir e reparsear a cada chamada. Os save_* atualizam o
+# cache logo após gravar.
+_cache: dict[str, tuple[float, object]] = {}
+
+
+def _cache_get(path: str):
+    """Retorna (hit, valor) do cache se o mtime do arquivo não mudou."""
+    entry = _cache.get(path)
+    if entry is None:
+        return False, None
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return False, None
+    if mtime != entry[0]:
+        return False, None
+    return True, entry[1]
+
+
+def _cache_put(path: str, value) -> None:
+    try:
+        _cache[path] = (os.stat(path).st_mtime, value)
+    except OSError:
+        _cache.pop(path, None)
 
 
 def _ensure_state_dir():
@@ -20,6 +48,30 @@ def _ensure_state_dir():
     os.makedirs(STATE_DIR, exist_ok=True)
 
 
+def _atomic_write(path: str, data: bytes) -> None:
+    """Grava `data` em `path` de forma atômica.
+
+    Escreve num arquivo temporário na mesma pasta, faz fsync e troca
+    com os.replace — um crash no meio da gravação nunca deixa o arquivo
+    de estado truncado.
+    """
+    tmp = tempfile.NamedTemporaryFile(
+        dir=STATE_DIR, prefix=os.path.basename(path) + ".", delete=False
+    )
+    try:
+        with tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp.name, path)
+    except Exception:
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+        raise
+
+
 def load_ultima_execucao_semana() -> Optional[date]:
     """
     Lê do disco a data da última execução semanal.
@@ -29,6 +81,10 @@ def load_ultima_execucao_semana() -> Optional[date]:
         - None: se o arquivo não existir ou houver erro de leitura/parse
     """
     try:
+        hit, cached = _cache_get(STATE_FILE_SEMANA)
+        if hit:
+            return cached
+
         if not os.path.exists(STATE_FILE_SEMANA):
             return None
 
@@ -39,7 +95,9 @@ def load_ultima_execucao_semana() -> Optional[date]:
             return None
 
         # Formato ISO: YYYY-MM-DD
-        return date.fromisoformat(conteudo)
+        d = date.fromisoformat(conteudo)
+        _cache_put(STATE_FILE_SEMANA, d)
+        return d
     except Exception:
         # Em caso de erro qualquer, consideramos como "nunca executado"
         return None
@@ -54,8 +112,8 @@ def save_ultima_execucao_semana(d: date) -> None:
     """
     _ensure_state_dir()
     try:
-        with open(STATE_FILE_SEMANA, "w", encoding="utf-8") as f:
-            f.write(d.isoformat())
+        _atomic_write(STATE_FILE_SEMANA, d.isoformat().encode("utf-8"))
+        _cache_put(STATE_FILE_SEMANA, d)
     except Exception as e:
         # Não vamos explodir a aplicação por erro de gravação,
         # mas é bom logar algo no console.
@@ -70,15 +128,31 @@ def load_aniversarios_enviados() -> dict:
     Caso o arquivo não exista ou esteja inválido, devolve um dicionário vazio.
     """
     try:
+        hit, cached = _cache_get(STATE_FILE_ANIVERSARIOS)
+        if hit:
+            return cached
+
         if not os.path.exists(STATE_FILE_ANIVERSARIOS):
             return {}
 
-        with open(STATE_FILE_ANIVERSARIOS, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(STATE_FILE_ANIVERSARIOS, "rb") as f:
+            data = orjson.loads(f.read())
 
         if isinstance(data, dict):
-            # garante que as chaves sejam strings; mantém valor como string se possível
-            return {str(k): (str(v) if v is not None else "") for k, v in data.items()}
+            # Caminho rápido: arquivo gravado pelo save_* já vem com
+            # chaves e valores string — devolve direto, sem reconstruir
+            # o dicionário inteiro a cada leitura.
+            if not all(
+                isinstance(k, str) and isinstance(v, str)
+                for k, v in data.items()
+            ):
+                # garante chaves string; mantém valor como string se possível
+                data = {
+                    str(k): (str(v) if v is not None else "")
+                    for k, v in data.items()
+                }
+            _cache_put(STATE_FILE_ANIVERSARIOS, data)
+            return data
     except Exception as e:
         print(f"[state_manager] Erro ao ler aniversarios_enviados: {e}")
 
@@ -93,46 +167,18 @@ def save_aniversarios_enviados(data: dict) -> None:
     """
     _ensure_state_dir()
     try:
-        with open(STATE_FILE_ANIVERSARIOS, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # orjson serializa numa passada só em C; uma escrita única de
+        # bytes substitui o json.dump incremental com indent.
+        _atomic_write(
+            STATE_FILE_ANIVERSARIOS,
+            orjson.dumps(
+                data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+            ),
+        )
+        _cache_put(STATE_FILE_ANIVERSARIOS, data)
     except Exception as e:
         print(f"[state_manager] Erro ao salvar aniversarios_enviados: {e}")
 
-def load_festividades_enviados() -> dict:
-    """Carrega do disco o mapa de envios de festividades (Natal/Ano Novo).
-
-    Formato esperado:
-    {
-      "<cliente>": {
-        "natal": "YYYY-MM-DD",
-        "ano_novo": "YYYY-MM-DD"
-      }
-    }
-    """
-    try:
-        if not os.path.exists(STATE_FILE_FESTIVIDADES):
-            return {}
-
-        with open(STATE_FILE_FESTIVIDADES, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if isinstance(data, dict):
-            out = {}
-            for k, v in data.items():
-                if isinstance(v, dict):
-                    out[str(k)] = {str(subk): (str(subv) if subv is not None else "") for subk, subv in v.items()}
-            return out
-    except Exception as e:
-        print(f"[state_manager] Erro ao ler festividades_enviados: {e}")
-
-    return {}
-
-
-def save_festividades_enviados(data: dict) -> None:
-    """Persiste o mapa de envios de festividades (Natal/Ano Novo) no disco."""
-    _ensure_state_dir()
-    try:
-        with open(STATE_FILE_FESTIVIDADES, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"[state_manager] Erro ao salvar festividades_enviados: {e}")        
\ No newline at end of file
+# O estado de festividades (Natal/Ano Novo) migrou para a tabela
+# festividades_log no banco (ver scripts/sql/festividades_log.sql):
+# o dedup acontece no próprio SELECT do festividades_service.
@@ -3,12 +3,29 @@ from fastapi.responses import JSONResponse
 from typing import Dict, Any, Optional
 import json
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
 
 router = APIRouter(tags=["webhooks"])
 
 logging.basicConfig(level="INFO", format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("evolution-webhook")
 
+# Log em fila: o handler async só enfileira o registro; a escrita no
+# stream (que bloqueia) acontece numa thread de fundo do QueueListener,
+# mantendo o event loop livre entre webhooks concorrentes.
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+)
+_log_listener = QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+log.addHandler(QueueHandler(_log_queue))
+log.propagate = False  # evita duplicar no handler síncrono do root
+
 def _pretty(obj: Any) -> str:
     try:
         return json.dumps(obj, ensure_ascii=False, indent=2)
@@ -24,52 +41,65 @@ async def _extract_json(request: Request) -> Dict[str, Any]:
         form = await request.form()
         if "payload" in form:
             try:
-                return json.loads(form["payload"])
+                return orjson.loads(form["payload"])
             except Exception:
                 pass
         return {k: v for k, v in form.items()}
 
+    # orjson.loads aceita bytes direto: parse em C numa passada só,
+    # sem o decode("utf-8") intermediário
     raw = await request.body()
     try:
-        return json.loads(raw.decode("utf-8"))
+        return orjson.loads(raw)
     except Exception:
         return {"raw": raw.decode("utf-8", errors="ignore")}
 
 def _summarize(body: Dict[str, Any], event_name: Optional[str]) -> Dict[str, Any]:
     summary = {"event_path": event_name, "keys": list(body.keys())}
-    if isinstance(body.get("event"), str):
-        summary["event_field"] = body["event"]
-    if isinstance(body.get("messages"), list):
-        msgs = body["messages"]
+    event = body.get("event")
+    if isinstance(event, str):
+        summary["event_field"] = event
+    msgs = body.get("messages")
+    if isinstance(msgs, list):
         summary["messages_count"] = len(msgs)
         if msgs:
             m0 = msgs[0]
-            summary["first_message_id"] = (m0.get("key") or {}).get("id")
-            summary["first_message_from"] = (m0.get("key") or {}).get("remoteJid")
-            if isinstance(m0.get("message"), dict):
-                summary["first_message_types"] = list(m0["message"].keys())
+            # resolve m0["key"] uma vez, sem alocar {} transitório
+            m0_key = m0.get("key")
+            if isinstance(m0_key, dict):
+                summary["first_message_id"] = m0_key.get("id")
+                summary["first_message_from"] = m0_key.get("remoteJid")
+            else:
+                summary["first_message_id"] = None
+                summary["first_message_from"] = None
+            m0_msg = m0.get("message")
+            if isinstance(m0_msg, dict):
+                summary["first_message_types"] = list(m0_msg.keys())
     if "status" in body:
         summary["status"] = body["status"]
     if "qrcode" in body:
         summary["has_qrcode_base64"] = True
     return summary
 
-@router.get("/webhook/ping")
+@router.get("/webhook/ping", response_model=None)
 def webhook_ping():
     log.info("Webhook ping OK")
     return {"ok": True, "msg": "webhook alive"}
 
-@router.post("/webhook")
+@router.post("/webhook", response_model=None)
 async def webhook_single(request: Request):
     body = await _extract_json(request)
-    log.info("=== Evolution Webhook (single) ===")
-    log.info("Headers:\n%s", _pretty(dict(request.headers)))
-    log.info("Body:\n%s", _pretty(body))
-    log.info("Summary:\n%s", _pretty(_summarize(body, None)))
+    # _pretty/_summarize serializam o payload inteiro — só pagamos esse
+    # custo se o nível INFO estiver realmente habilitado
+    if log.isEnabledFor(logging.INFO):
+        log.info("=== Evolution Webhook (single) ===")
+        log.info("Headers:\n%s", _pretty(dict(request.headers)))
+        log.info("Body:\n%s", _pretty(body))
+        log.info("Summary:\n%s", _pretty(_summarize(body, None)))
     return {"ok": True}
 
 # Substitui a rota /webhook/{event_name} por uma flexível
-@router.post("/webhook/{tail:path}")
+@router.post("/webhook/{tail:path}", response_model=None)
 async def webhook_by_events_flex(tail: str, request: Request):
     """
     Aceita caminhos como:
@@ -85,11 +115,12 @@ async def webhook_by_events_flex(tail: str, request: Request):
 
     body = await _extract_json(request)
 
-    log.info("=== Evolution Webhook (by-events - flex) ===")
-    log.info("Event path (raw tail): %s", tail)
-    log.info("Event name (normalized): %s", event_name)
-    log.info("Headers:\n%s", _pretty(dict(request.headers)))
-    log.info("Body:\n%s", _pretty(body))
-    log.info("Summary:\n%s", _pretty(_summarize(body, event_name)))
+    if log.isEnabledFor(logging.INFO):
+        log.info("=== Evolution Webhook (by-events - flex) ===")
+        log.info("Event path (raw tail): %s", tail)
+        log.info("Event name (normalized): %s", event_name)
+        log.info("Headers:\n%s", _pretty(dict(request.headers)))
+        log.info("Body:\n%s", _pretty(body))
+        log.info("Summary:\n%s", _pretty(_summarize(body, event_name)))
 
     return {"ok": True, "event": event_name}
\ No newline at end of file